@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 # BASE_DIR: ./../../
@@ -31,10 +32,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'constance',
 ]
 
 MIDDLEWARE = [
+    # first, to account for the work of all the others
+    'openclass.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -151,12 +155,64 @@ EMAIL_PORT = 587
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 # constance app config
-CONSTANCE_BACKEND = 'constance.backends.redisd.RedisBackend'
+# redis backend with a short lived per-process copy of the values
+CONSTANCE_BACKEND = 'openclass.constance_backend.CachedRedisBackend'
 CONSTANCE_REDIS_CONNECTION = {
     'host': 'db_redis',
     'port': 6379,
     'db': 0,
 }
 
+# leaderboard, a sorted set in the same redis instance
+LEADERBOARD_REDIS_CONNECTION = {
+    'host': 'db_redis',
+    'port': 6379,
+    'db': 1,
+}
+
+# cache shared by all the workers, in the same redis instance
+CACHES = {
+    'default': {
+        # django_redis.cache.RedisCache counting hits and misses per request
+        'BACKEND': 'openclass.instrumentation.InstrumentedRedisCache',
+        'LOCATION': 'redis://db_redis:6379/2',
+        'KEY_PREFIX': 'openclass',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+        },
+    }
+}
+# a cache failure is a miss, not an error page
+DJANGO_REDIS_IGNORE_EXCEPTIONS = True
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
+# requests slower than this (in seconds) are logged with their SQL queries
+SLOW_REQUEST_THRESHOLD = 1.0
+
+# INFO logs a line per request (see openclass/instrumentation.py), the
+# test runner only shows the warnings unless OPENCLASS_LOG_LEVEL says
+# otherwise; the tests checking the request log capture it with assertLogs
+RUNNING_TESTS = len(sys.argv) > 1 and sys.argv[1] == 'test'
+LOG_LEVEL = os.environ.get('OPENCLASS_LOG_LEVEL',
+                           'WARNING' if RUNNING_TESTS else 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'openclass': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+        },
+    },
+}
+
 # import constance
 from ..constance_config import *
@@ -25,3 +25,5 @@ admin.site.register(FAQ)
 admin.site.register(Feedback)
 admin.site.register(Preference)
 admin.site.register(Link)
+admin.site.register(OutgoingEmail)
+admin.site.register(EmailBroadcast)
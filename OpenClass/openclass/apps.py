@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, post_save, post_delete
 
 
 class OpenclassConfig(AppConfig):
     name = 'openclass'
+
+    def ready(self):
+        from . import search, pagecache
+        from .models import Profile, Registration, Workshop
+        post_migrate.connect(search.install_search_indexes, sender=self)
+        post_delete.connect(Registration.deleted, sender=Registration)
+        post_delete.connect(Profile.deleted, sender=Profile)
+        post_save.connect(Workshop.changed, sender=Workshop)
+        post_delete.connect(Workshop.changed, sender=Workshop)
+        pagecache.connect_signals(self)
@@ -0,0 +1,72 @@
+"""constance redis backend with a per-process copy of the values.
+
+Templates read a dozen config keys per page, each one a redis round trip
+with the stock backend. Here all the values are loaded at once and kept
+in the process for LOCAL_TIMEOUT seconds. After that a single GET of a
+version key, bumped by every set(), tells whether they must be reloaded,
+so an admin edit is seen by every worker within LOCAL_TIMEOUT."""
+
+import logging
+import time
+from pickle import loads
+import redis
+from constance import settings
+from constance.backends.redisd import RedisBackend
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TIMEOUT = 5
+VERSION_KEY = 'openclass:version'
+
+class CachedRedisBackend(RedisBackend):
+
+    def __init__(self):
+        super().__init__()
+        self._values = None
+        self._version = None
+        self._expires = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._values is not None and now < self._expires:
+            return
+        try:
+            if self._values is None:
+                self._load()
+            else:
+                version = self._rd.get(self.add_prefix(VERSION_KEY))
+                if version != self._version:
+                    self._load()
+        except redis.RedisError:
+            if self._values is None:
+                raise
+            logger.warning("can't refresh the config, keep the local values")
+        self._expires = now + LOCAL_TIMEOUT
+
+    def _load(self):
+        """Read the version and all the values in one round trip."""
+
+        keys = list(settings.CONFIG)
+        pipe = self._rd.pipeline()
+        pipe.get(self.add_prefix(VERSION_KEY))
+        pipe.mget([self.add_prefix(key) for key in keys])
+        version, values = pipe.execute()
+        self._values = {
+            key: loads(value) for key, value in zip(keys, values) if value
+            }
+        self._version = version
+
+    def get(self, key):
+        self._refresh()
+        return self._values.get(key)
+
+    def mget(self, keys):
+        self._refresh()
+        for key in keys:
+            if key in self._values:
+                yield key, self._values[key]
+
+    def set(self, key, value):
+        super().set(key, value)
+        self._rd.incr(self.add_prefix(VERSION_KEY))
+        self._values = None
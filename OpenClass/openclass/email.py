@@ -1,14 +1,166 @@
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
-from .models import User
+from django.utils import timezone
 
 # TODO : check if the emails can be sent
 
 def get_url():
     return 'http://localhost:8000'
 
+def queue_mail(subject, message, from_email, recipient_list, html_message=None):
+    """Put an email in the outbox, it will be sent by send_queued_mail().
+    Same arguments as django.core.mail.send_mail()."""
+
+    # models imports this module
+    from .models import OutgoingEmail
+
+    return OutgoingEmail.objects.create(
+                    subject=subject,
+                    body=message,
+                    html_body=html_message or '',
+                    from_email=from_email or '',
+                    recipients='\n'.join(recipient_list),
+                    )
+
+def send_queued_mail(batch_size=100, connection=None):
+    """Send the due emails of the outbox over a single SMTP connection.
+    Return the number of emails sent and failed.
+
+    The batch is claimed in a short transaction, then sent without any
+    lock held: the claim pushes next_attempt_date by CLAIM_DELAY, so the
+    other workers leave the batch alone and a worker dying while sending
+    only delays it."""
+
+    from .models import OutgoingEmail
+
+    sent = failed = 0
+    connection = connection or get_connection()
+    with transaction.atomic():
+        # rows locked by another worker are left to it
+        outbox = OutgoingEmail.objects.filter(
+                            status=OutgoingEmail.QUEUED,
+                            next_attempt_date__lte=timezone.now(),
+                            ).order_by('next_attempt_date', 'pk')
+        outbox = outbox.select_for_update(skip_locked=True)[:batch_size]
+        outbox = list(outbox)
+        if not outbox:
+            return sent, failed
+        OutgoingEmail.objects.filter(
+                    pk__in=[outgoing_email.pk for outgoing_email in outbox],
+                    ).update(
+                    next_attempt_date=timezone.now() + OutgoingEmail.CLAIM_DELAY
+                    )
+
+    try:
+        connection.open()
+    except Exception as error:
+        for outgoing_email in outbox:
+            outgoing_email.retry_later(error)
+        return sent, len(outbox)
+
+    try:
+        for outgoing_email in outbox:
+            msg = EmailMultiAlternatives(
+                        outgoing_email.subject,
+                        outgoing_email.body,
+                        outgoing_email.from_email or None,
+                        outgoing_email.get_recipients(),
+                        connection=connection,
+                        )
+            if outgoing_email.html_body:
+                msg.attach_alternative(outgoing_email.html_body, 'text/html')
+            try:
+                msg.send()
+            except Exception as error:
+                outgoing_email.retry_later(error)
+                failed += 1
+            else:
+                outgoing_email.sent()
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+def send_broadcast_chunk(broadcast_pk, chunk_size=100, connection=None):
+    """Send the next chunk of a broadcast, one message per recipient over a
+    single connection.
+    Return the number of emails sent, None when the broadcast is done or
+    not due.
+
+    As in send_queued_mail(), the chunk is claimed in a short transaction
+    then sent without any lock held. The progress cursor moves past each
+    recipient as soon as their email is sent, so a failure only sends the
+    rest of the chunk again."""
+
+    from .models import EmailBroadcast
+
+    connection = connection or get_connection()
+    with transaction.atomic():
+        broadcast = EmailBroadcast.pending().select_for_update(
+                                                    skip_locked=True)
+        broadcast = broadcast.filter(
+                            pk=broadcast_pk,
+                            next_attempt_date__lte=timezone.now(),
+                            ).first()
+        if broadcast is None: # done, not due or handled by another worker
+            return None
+
+        recipients = broadcast.next_recipients(chunk_size)
+        if not recipients:
+            broadcast.done()
+            return None
+        broadcast.claim()
+
+    sent = 0
+    try:
+        for user_pk, recipient_email in recipients:
+            message = EmailMessage(
+                        broadcast.subject,
+                        broadcast.body,
+                        broadcast.from_email or None,
+                        [recipient_email],
+                        )
+            # like send_mass_mail(), but on the worker's connection
+            connection.send_messages([message])
+            broadcast.recipient_sent(user_pk)
+            sent += 1
+    except Exception as error:
+        # the rest of the chunk will be sent after a backoff
+        broadcast.retry_later(error)
+        raise
+    broadcast.chunk_sent()
+    return sent
+
+def send_broadcasts(chunk_size=100, connection=None):
+    """Send all the due broadcasts, chunk by chunk.
+    Return the number of emails sent."""
+
+    from .models import EmailBroadcast
+
+    sent = 0
+    connection = connection or get_connection()
+    pending = EmailBroadcast.pending().filter(
+                            next_attempt_date__lte=timezone.now(),
+                            ).order_by('pk')
+    with connection:
+        for broadcast_pk in pending.values_list('pk', flat=True):
+            while True:
+                try:
+                    count = send_broadcast_chunk(
+                                            broadcast_pk,
+                                            chunk_size,
+                                            connection,
+                                            )
+                except Exception:
+                    break # the error is saved in the broadcast
+                if count is None:
+                    break
+                sent += count
+    return sent
+
 def send_verification_mail(user, token):
     site_url = get_url()
     context = {}
@@ -20,7 +172,7 @@ def send_verification_mail(user, token):
             (site_url, reverse('openclass:verify', kwargs={'token':token}))
     html_msg = render_to_string('openclass/email_verification.html', context)
     to = [user.email,]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to, html_message=html_msg)
+    queue_mail(subject, msg, settings.EMAIL_HOST_USER, to, html_message=html_msg)
 
 
 def ask_for_feedback(workshop):
@@ -36,7 +188,7 @@ def ask_for_feedback(workshop):
             )
     to = [email[0] for email in \
             workshop.registration_set.filter(present=True).values_list('profile__user__email')]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to)
+    queue_mail(subject, msg, settings.EMAIL_HOST_USER, to)
 
 def notify_registration_acceptance(workshop, user):
     site_url = get_url()
@@ -53,7 +205,7 @@ def notify_registration_acceptance(workshop, user):
                     )
             )
     to = [user.email,]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to)
+    queue_mail(subject, msg, settings.EMAIL_HOST_USER, to)
 
 def notify_registration_refusal(workshop, user):
     site_url = get_url()
@@ -61,7 +213,7 @@ def notify_registration_refusal(workshop, user):
     msg = """We are really sorry,\
             You have been refused to the %s workshop.""" % workshop.title
     to = [user.email,]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to)
+    queue_mail(subject, msg, settings.EMAIL_HOST_USER, to)
 
 
 def notify_new_workshop(workshop):
@@ -76,9 +228,14 @@ def notify_new_workshop(workshop):
                 kwargs={'workshop_pk': workshop.pk}
                 ),
             )
-    to = [email[0] for email in \
-            User.objects.filter(profile__preference__notify_new_workshop=True).values_list('email')]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to)
+    from .models import EmailBroadcast
+
+    # sent to each subscriber separately by send_broadcasts()
+    EmailBroadcast.objects.create(
+                    subject=subject,
+                    body=msg,
+                    from_email=settings.EMAIL_HOST_USER,
+                    )
 
 
 def notify_workshop_accepted(workshop):
@@ -94,7 +251,7 @@ def notify_workshop_accepted(workshop):
                 ),
             )
     to = [workshop.animator.user.email,]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to)
+    queue_mail(subject, msg, settings.EMAIL_HOST_USER, to)
 
 
 def notify_workshop_refused(workshop):
@@ -102,4 +259,4 @@ def notify_workshop_refused(workshop):
     subject = "Your workshop has been refused"
     msg = """We are really sorry, your workshop has been refused."""
     to = [workshop.animator.user.email,]
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, to)
+    queue_mail(subject, msg, settings.EMAIL_HOST_USER, to)
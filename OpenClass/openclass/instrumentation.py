@@ -0,0 +1,163 @@
+"""Per-request instrumentation: SQL queries, database time, cache hits and
+misses and total duration of every request.
+
+InstrumentationMiddleware logs one JSON line per request on the
+'openclass.requests' logger and aggregates the numbers per view in
+the metrics of all the workers (see metrics.py).
+A request slower than settings.SLOW_REQUEST_THRESHOLD is
+also logged as a warning along with its SQL queries."""
+
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django_redis.cache import RedisCache
+from . import metrics
+
+logger = logging.getLogger('openclass.requests')
+
+# upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# SQL kept for the slow request dump
+MAX_RECORDED_QUERIES = 200
+
+_local = threading.local()
+
+METRIC_BUCKETS = {
+    'duration_seconds': DURATION_BUCKETS,
+    'db_seconds': DURATION_BUCKETS,
+    'queries': QUERIES_BUCKETS,
+}
+
+def observe(metric, view_name, value):
+    metrics.observe_histogram(
+                'openclass_request_' + metric,
+                {'view': view_name},
+                value,
+                METRIC_BUCKETS[metric],
+                )
+
+def redact_path(request):
+    """Get the path of the request with its URL arguments replaced by
+    their names: the tokens of the verification, check-in and password
+    reset links must not end up in the logs."""
+
+    match = request.resolver_match
+    if match is None:
+        return request.path
+    arguments = {str(value): '<%s>' % name
+                 for name, value in match.kwargs.items()}
+    arguments.update((str(value), '<arg>') for value in match.args)
+    return '/'.join(arguments.get(segment, segment)
+                    for segment in request.path.split('/'))
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.sql = []
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper timing every query."""
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            if len(self.sql) < MAX_RECORDED_QUERIES:
+                self.sql.append((duration, sql))
+
+def current_stats():
+    """Get the stats of the request being processed by this thread."""
+
+    return getattr(_local, 'stats', None)
+
+class InstrumentedRedisCache(RedisCache):
+    """Redis cache counting the hits and misses of the current request."""
+
+    def get(self, key, default=None, version=None, client=None):
+        value = super().get(key, None, version, client)
+        stats = current_stats()
+        if stats is not None:
+            if value is None:
+                stats.cache_misses += 1
+            else:
+                stats.cache_hits += 1
+        return default if value is None else value
+
+    def get_many(self, keys, *args, **kwargs):
+        values = super().get_many(keys, *args, **kwargs) or {}
+        stats = current_stats()
+        if stats is not None:
+            stats.cache_hits += len(values)
+            stats.cache_misses += len(keys) - len(values)
+        return values
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _local.stats = stats
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                            connection.execute_wrapper(stats.record_query)
+                            )
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        duration = time.perf_counter() - start
+        self.report(request, response, stats, duration)
+        return response
+
+    def report(self, request, response, stats, duration):
+        match = request.resolver_match
+        view_name = match.view_name if match else '<unresolved>'
+        observe('duration_seconds', view_name, duration)
+        observe('db_seconds', view_name, stats.db_time)
+        observe('queries', view_name, stats.queries)
+        metrics.inc_counter('openclass_requests_total', {
+                                'view': view_name,
+                                'method': request.method,
+                                'status': response.status_code,
+                                })
+        metrics.inc_counter('openclass_cache_hits_total',
+                            amount=stats.cache_hits)
+        metrics.inc_counter('openclass_cache_misses_total',
+                            amount=stats.cache_misses)
+        metrics.flush()
+
+        line = {
+            'view': view_name,
+            'method': request.method,
+            'path': redact_path(request),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 1),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+        }
+        logger.info(json.dumps(line, sort_keys=True))
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            # the slowest queries first
+            line['sql'] = [
+                {'ms': round(query_time * 1000, 1), 'sql': sql}
+                for query_time, sql in sorted(stats.sql, reverse=True)
+                ]
+            logger.warning(json.dumps(line, sort_keys=True))
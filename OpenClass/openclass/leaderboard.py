@@ -0,0 +1,137 @@
+"""Members ranking kept in a redis sorted set (profile pk -> score).
+
+The database stays the source of truth: the set is updated when points
+are gained and can be rebuilt at any time with
+./manage.py rebuild_leaderboard, which runs at deploy. A set that was
+never built or lost by redis is rebuilt on the next read. If redis is
+unreachable the ranking is read from the database instead."""
+
+import logging
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_KEY = 'openclass:leaderboard'
+REBUILD_CHUNK_SIZE = 1000
+# a single worker rebuilds a missing set
+REBUILD_LOCK_TIMEOUT = 60
+
+_connection = None
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        _connection = redis.StrictRedis(
+                            socket_timeout=1,
+                            **settings.LEADERBOARD_REDIS_CONNECTION
+                            )
+    return _connection
+
+def add_member(profile_pk, score=0):
+    """Add a new member, keep the current score if already ranked."""
+
+    try:
+        get_connection().zadd(LEADERBOARD_KEY, {profile_pk: score}, nx=True)
+    except redis.RedisError:
+        logger.warning("can't add profile %s to the leaderboard", profile_pk)
+
+def remove_member(profile_pk):
+    try:
+        get_connection().zrem(LEADERBOARD_KEY, profile_pk)
+    except redis.RedisError:
+        logger.warning("can't remove profile %s from the leaderboard",
+                       profile_pk)
+
+def add_points(profile_pk, points):
+    try:
+        get_connection().zincrby(LEADERBOARD_KEY, points, profile_pk)
+    except redis.RedisError:
+        logger.warning("can't add points to profile %s", profile_pk)
+
+def add_points_many(profile_pks, points):
+    try:
+        pipe = get_connection().pipeline(transaction=False)
+        for profile_pk in profile_pks:
+            pipe.zincrby(LEADERBOARD_KEY, points, profile_pk)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("can't add points to %d profiles", len(profile_pks))
+
+def ensure_built():
+    """Rebuild the set if it was never built, e.g. redis lost its data.
+    The set itself can't tell: points gained meanwhile created it."""
+
+    connection = get_connection()
+    if connection.exists(LEADERBOARD_KEY + ':built'):
+        return
+    if connection.set(LEADERBOARD_KEY + ':lock', 1,
+                      nx=True, ex=REBUILD_LOCK_TIMEOUT):
+        try:
+            rebuild()
+        finally:
+            connection.delete(LEADERBOARD_KEY + ':lock')
+
+def top(offset, count):
+    """Get the (profile_pk, score) of the members ranked from offset + 1 to
+    offset + count, O(log(n) + count)."""
+
+    try:
+        ensure_built()
+        ranking = get_connection().zrevrange(
+                                    LEADERBOARD_KEY,
+                                    offset,
+                                    offset + count - 1,
+                                    withscores=True,
+                                    )
+        return [(int(pk), int(score)) for pk, score in ranking]
+    except redis.RedisError:
+        from .models import Profile
+        ranking = Profile.objects.order_by('-score', 'pk')
+        ranking = ranking.values_list('pk', 'score')
+        return list(ranking[offset:offset + count])
+
+def rank(profile):
+    """Get the 1-based rank of a member, O(log(n))."""
+
+    try:
+        ensure_built()
+        rank = get_connection().zrevrank(LEADERBOARD_KEY, profile.pk)
+        return None if rank is None else rank + 1
+    except redis.RedisError:
+        from .models import Profile
+        return Profile.objects.filter(score__gt=profile.score).count() + 1
+
+def size():
+    try:
+        ensure_built()
+        return get_connection().zcard(LEADERBOARD_KEY)
+    except redis.RedisError:
+        from .models import Profile
+        return Profile.objects.count()
+
+def rebuild():
+    """Reload the scores from the database into a new set that atomically
+    replaces the current one. Return the number of members."""
+
+    from .models import Profile
+
+    connection = get_connection()
+    tmp_key = LEADERBOARD_KEY + ':rebuild'
+    connection.delete(tmp_key)
+    count = 0
+    pipe = connection.pipeline(transaction=False)
+    scores = Profile.objects.values_list('pk', 'score')
+    for pk, score in scores.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+        pipe.zadd(tmp_key, {pk: score})
+        count += 1
+        if count % REBUILD_CHUNK_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+    if count:
+        connection.rename(tmp_key, LEADERBOARD_KEY)
+    else:
+        connection.delete(LEADERBOARD_KEY)
+    connection.set(LEADERBOARD_KEY + ':built', 1)
+    return count
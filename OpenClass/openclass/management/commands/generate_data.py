@@ -0,0 +1,277 @@
+import random
+from collections import Counter
+from datetime import date, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from openclass.models import *
+from openclass import leaderboard, pagecache, search
+
+BATCH_SIZE = 1000
+# 0 is infinite
+SEATS_NUMBERS = (0, 30, 50, 100, 200)
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic members, workshops, " \
+           "registrations, questions and feedback for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--workshops', type=int, default=200)
+        parser.add_argument('--registrations', type=int, default=10,
+                            help="registrations per member")
+        parser.add_argument('--questions', type=int, default=2,
+                            help="questions per member")
+        parser.add_argument('--tags', type=int, default=30)
+        parser.add_argument('--badges', type=int, default=10)
+        parser.add_argument('--prefix', default='load',
+                            help="prefix of the generated usernames, "
+                                 "tags and badges")
+        parser.add_argument('--password', default='openclass',
+                            help="password of all the generated members")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.now = timezone.now()
+
+        with transaction.atomic():
+            tags = self.create_tags(options['tags'])
+            badges = self.create_badges(options['badges'])
+            profiles = self.create_members(
+                                options['users'],
+                                options['password'],
+                                tags,
+                                badges,
+                                )
+            workshops = self.create_workshops(
+                                options['workshops'],
+                                profiles,
+                                tags,
+                                )
+            self.create_registrations(
+                                profiles,
+                                workshops,
+                                options['registrations'],
+                                )
+            self.create_questions(profiles, workshops, options['questions'])
+            self.create_feedback(workshops)
+
+            # what the model methods would have maintained row by row
+            workshops = Workshop.objects.filter(
+                                pk__in=[workshop.pk for workshop in workshops]
+                                )
+            Workshop.recount_registrations(workshops)
+            search.update_search_vector(workshops)
+            Workshop.objects.clear_status_counts()
+            pagecache.invalidate('workshops', 'badges')
+        leaderboard.rebuild()
+
+    def log(self, count, name):
+        self.stdout.write("%d %s created" % (count, name))
+
+    def bulk_create(self, model, objects):
+        # within the limits of the database on the number of parameters
+        batch_size = connection.ops.bulk_batch_size(
+                                    model._meta.concrete_fields,
+                                    objects,
+                                    )
+        batch_size = min(BATCH_SIZE, batch_size)
+        model.objects.bulk_create(objects, batch_size=batch_size)
+
+    def create_tags(self, count):
+        names = ['%s%d' % (self.prefix, i) for i in range(count)]
+        self.bulk_create(Tag, [Tag(name=name) for name in names])
+        self.log(count, "tags")
+        # bulk_create only sets the pks on PostgreSQL
+        return list(Tag.objects.filter(name__in=names))
+
+    def create_badges(self, count):
+        names = ['%s%d' % (self.prefix, i) for i in range(count)]
+        self.bulk_create(Badge, [
+            Badge(name=name, description="Synthetic badge")
+            for name in names
+            ])
+        self.log(count, "badges")
+        return list(Badge.objects.filter(name__in=names))
+
+    def create_members(self, count, password, tags, badges):
+        # hashing is slow on purpose, all the members share the hash
+        password = make_password(password)
+        usernames = ['%s%d' % (self.prefix, i) for i in range(count)]
+        self.bulk_create(User, [
+            User(username=username,
+                 email='%s@example.com' % username,
+                 first_name=username,
+                 last_name=self.prefix,
+                 password=password,
+                 date_joined=self.now)
+            for username in usernames
+            ])
+        users = User.objects.filter(username__in=usernames)
+        self.bulk_create(Profile, [
+            Profile(user=user,
+                    phone_number='0555',
+                    birthday=date(1990 + user.pk % 15, 1, 1),
+                    score=self.random.randrange(500))
+            for user in users
+            ])
+        profiles = list(Profile.objects.filter(user__in=users))
+        self.bulk_create(Preference, [
+            Preference(profile=profile) for profile in profiles
+            ])
+        self.bulk_create(Profile.interests.through, [
+            Profile.interests.through(profile=profile, tag=tag)
+            for profile in profiles
+            for tag in self.random.sample(tags, min(3, len(tags)))
+            ])
+        self.bulk_create(Have_badge, [
+            Have_badge(profile=profile, badge=badge, priority=1)
+            for profile in profiles
+            for badge in self.random.sample(badges, min(2, len(badges)))
+            ])
+        self.bulk_create(Link, [
+            Link(profile=profile,
+                 link_type=Link.LINK_GITHUB,
+                 url='https://github.com/%s' % profile.user.username)
+            for profile in profiles
+            ])
+        # a moderator for the dashboard scenario
+        moderator = profiles[0].user
+        moderator.is_staff = True
+        moderator.save()
+        self.log(count, "members")
+        return profiles
+
+    def create_workshops(self, count, profiles, tags):
+        title = '%s workshop %%d' % self.prefix
+        workshops = []
+        for i in range(count):
+            kind = self.random.random()
+            if kind < 0.5:
+                status = Workshop.ACCEPTED
+                days = self.random.randrange(1, 90)
+            elif kind < 0.8:
+                status = Workshop.DONE
+                days = -self.random.randrange(1, 365)
+            else:
+                status = self.random.choice((Workshop.PENDING,
+                                             Workshop.REFUSED))
+                days = self.random.randrange(1, 90)
+            start_date = self.now + timedelta(days=days)
+            workshops.append(Workshop(
+                        title=title % i,
+                        description="Synthetic workshop about %s" %
+                                    ' '.join(t.name for t in
+                                             self.random.sample(tags, 2)),
+                        required_materials="laptop",
+                        objectives="load testing",
+                        requirements="none",
+                        seats_number=self.random.choice(SEATS_NUMBERS),
+                        submission_date=start_date - timedelta(days=30),
+                        decision_date=start_date - timedelta(days=20),
+                        start_date=start_date,
+                        duration=timedelta(hours=2),
+                        location="amphi %d" % self.random.randrange(10),
+                        status=status,
+                        animator=self.random.choice(profiles),
+                        ))
+        self.bulk_create(Workshop, workshops)
+        workshops = list(Workshop.objects.filter(
+                                title__in=[title % i for i in range(count)]
+                                ))
+        self.bulk_create(Workshop.topics.through, [
+            Workshop.topics.through(workshop=workshop, tag=tag)
+            for workshop in workshops
+            for tag in self.random.sample(tags, min(2, len(tags)))
+            ])
+        mc_questions = list(MCQuestion.objects.all()[:5])
+        if not mc_questions:
+            for i in range(5):
+                mc_question = MCQuestion.objects.create(
+                                    question="Rate the part %d" % i
+                                    )
+                for choice in ('bad', 'average', 'good'):
+                    mc_question.choices.create(choice=choice)
+                mc_questions.append(mc_question)
+        self.bulk_create(Workshop.mc_questions.through, [
+            Workshop.mc_questions.through(workshop=workshop,
+                                          mcquestion=mc_question)
+            for workshop in workshops
+            for mc_question in mc_questions
+            ])
+        self.log(count, "workshops")
+        return workshops
+
+    def create_registrations(self, profiles, workshops, count):
+        open_workshops = [
+            w for w in workshops
+            if w.status in (Workshop.ACCEPTED, Workshop.DONE)
+            ]
+        count = min(count, len(open_workshops))
+        seats_taken = Counter()
+        registrations = []
+        for profile in profiles:
+            for workshop in self.random.sample(open_workshops, count):
+                has_seat = workshop.seats_number == Workshop.INFINITE_SEATS_NB \
+                           or seats_taken[workshop.pk] < workshop.seats_number
+                if has_seat:
+                    seats_taken[workshop.pk] += 1
+                    status = Registration.ACCEPTED
+                elif workshop.registration_politic == Workshop.POL_FIFO:
+                    status = Registration.WAITLISTED
+                else:
+                    # left to the moderators
+                    status = Registration.PENDING
+                done = workshop.status == Workshop.DONE
+                registration_date = workshop.start_date - timedelta(days=7)
+                registrations.append(Registration(
+                        workshop=workshop,
+                        profile=profile,
+                        date_registration=registration_date,
+                        status=status,
+                        present=has_seat and done and self.random.random() < 0.8,
+                        ))
+        self.bulk_create(Registration, registrations)
+        self.log(len(registrations), "registrations")
+
+    def create_questions(self, profiles, workshops, count):
+        questions = [
+            Question(author=profile,
+                     workshop=self.random.choice(workshops),
+                     question="Synthetic question %d?" % i)
+            for profile in profiles
+            for i in range(count)
+            ]
+        self.bulk_create(Question, questions)
+        self.log(len(questions), "questions")
+
+    def create_feedback(self, workshops):
+        presences = Registration.objects.filter(
+                                    workshop__in=workshops,
+                                    workshop__status=Workshop.DONE,
+                                    present=True,
+                                    )
+        self.bulk_create(Feedback, [
+            Feedback(workshop_id=registration.workshop_id,
+                     author_id=registration.profile_id,
+                     submission_date=self.now,
+                     comment="Synthetic feedback")
+            for registration in presences
+            if self.random.random() < 0.5
+            ])
+        feedbacks = Feedback.objects.filter(workshop__in=workshops)
+        choices = {}
+        for choice in Choice.objects.filter(
+                            question__workshop__in=workshops).distinct():
+            choices.setdefault(choice.question_id, []).append(choice)
+        self.bulk_create(Feedback.choices.through, [
+            Feedback.choices.through(feedback=feedback, choice=choice)
+            for feedback in feedbacks
+            for choice in (self.random.choice(c) for c in choices.values())
+            ])
+        self.log(feedbacks.count(), "feedbacks")
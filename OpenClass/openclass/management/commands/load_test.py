@@ -0,0 +1,236 @@
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor, Request
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from openclass.models import Workshop
+
+SCENARIOS = ('browse', 'registration_burst', 'moderation')
+
+
+def percentile(sorted_values, rank):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return 0
+    index = max(int(round(rank / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[index]
+
+
+class Session:
+    """A visitor of the site with its own cookies."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, path, data=None, ajax=False):
+        """Get (status, seconds, body), status 0 if the server can't be
+        reached."""
+
+        headers = {'X-CSRFToken': self.csrf_token()}
+        if ajax:
+            headers['X-Requested-With'] = 'XMLHttpRequest'
+        if data is not None:
+            data = urlencode(data).encode()
+        request = Request(self.base_url + path, data, headers)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                body = response.read()
+                status = response.status
+        except HTTPError as error:
+            body = error.read()
+            status = error.code
+        except URLError:
+            body = b''
+            status = 0
+        return status, time.perf_counter() - start, body
+
+    def login(self, username, password):
+        path = reverse('openclass:login')
+        self.request(path)
+        self.request(path, {
+                        'username': username,
+                        'password': password,
+                        'csrfmiddlewaretoken': self.csrf_token(),
+                        })
+
+
+class Command(BaseCommand):
+    help = "Run load test scenarios against a running server and report " \
+           "the throughput and the latency percentiles. The members are " \
+           "the ones made by ./manage.py generate_data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append',
+                            choices=SCENARIOS,
+                            help="run only this scenario, can be repeated")
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=500,
+                            help="requests per scenario, members in the "
+                                 "registration burst")
+        parser.add_argument('--prefix', default='load',
+                            help="prefix of the generated usernames")
+        parser.add_argument('--password', default='openclass')
+        parser.add_argument('--workshop', type=int,
+                            help="workshop of the registration burst, "
+                                 "default: the upcoming one with the most "
+                                 "seats left")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.pool = ThreadPoolExecutor(options['concurrency'])
+        for scenario in options['scenario'] or SCENARIOS:
+            getattr(self, scenario)()
+
+    def sessions(self, usernames):
+        """Logged in sessions, the logins are not measured."""
+
+        def login(username):
+            session = Session(self.options['url'])
+            session.login(username, self.options['password'])
+            return session
+        return list(self.pool.map(login, usernames))
+
+    def run(self, name, jobs):
+        """Run the (session, path, data, ajax) jobs concurrently."""
+
+        def send(job):
+            session, path, data, ajax = job
+            return session.request(path, data, ajax)
+
+        start = time.perf_counter()
+        results = list(self.pool.map(send, jobs))
+        elapsed = time.perf_counter() - start
+
+        durations = sorted(duration for status, duration, body in results)
+        errors = sum(1 for status, duration, body in results
+                     if not 200 <= status < 400)
+        self.stdout.write(
+            "%s: %d requests, %d errors, %.1f req/s, "
+            "p50 %.0f ms, p95 %.0f ms, p99 %.0f ms" % (
+                name,
+                len(results),
+                errors,
+                len(results) / elapsed,
+                percentile(durations, 50) * 1000,
+                percentile(durations, 95) * 1000,
+                percentile(durations, 99) * 1000,
+                ))
+        return results
+
+    def browse(self):
+        """Anonymous visitors going through the workshop lists."""
+
+        workshops = list(Workshop.objects.filter(
+                                status__in=(Workshop.ACCEPTED, Workshop.DONE)
+                                ).values_list('pk', flat=True))
+        if not workshops:
+            raise CommandError("no workshop, run ./manage.py generate_data")
+        paths = [
+            reverse('openclass:index'),
+            reverse('openclass:workshops_list'),
+            reverse('openclass:upcoming_workshops_list'),
+            reverse('openclass:faq'),
+            ]
+        sessions = [
+            Session(self.options['url'])
+            for i in range(self.options['concurrency'])
+            ]
+        jobs = []
+        for i in range(self.options['requests']):
+            if self.random.random() < 0.5:
+                path = self.random.choice(paths)
+            else:
+                path = reverse('openclass:workshops_detail',
+                               args=(self.random.choice(workshops),))
+            jobs.append((self.random.choice(sessions), path, None, False))
+        self.run("browse", jobs)
+
+    def registration_burst(self):
+        """The members registering to the same workshop at once, like on
+        the opening day."""
+
+        workshop = self.options['workshop']
+        if workshop is None:
+            workshop = Workshop.objects.filter(
+                                status=Workshop.ACCEPTED,
+                                registration_politic=Workshop.POL_FIFO,
+                                start_date__gt=timezone.now(),
+                                ).exclude(
+                                seats_number=Workshop.INFINITE_SEATS_NB,
+                                ).annotate(
+                                seats_left=F('seats_number') - F('accepted_count'),
+                                ).order_by('-seats_left').first()
+            if workshop is None:
+                raise CommandError("no upcoming FIFO workshop")
+            workshop = workshop.pk
+        usernames = User.objects.filter(
+                            username__startswith=self.options['prefix'],
+                            is_staff=False,
+                            ).values_list('username', flat=True)
+        sessions = self.sessions(usernames[:self.options['requests']])
+        path = reverse('openclass:register_to_workshop')
+        jobs = [
+            (session, path, {'workshop_pk': workshop}, True)
+            for session in sessions
+            ]
+        results = self.run("registration burst", jobs)
+
+        outcomes = Counter()
+        for status, duration, body in results:
+            try:
+                outcomes[json.loads(body.decode())['status']] += 1
+            except (ValueError, KeyError):
+                outcomes['HTTP %d' % status] += 1
+        self.stdout.write("    %s" % ', '.join(
+                                '%s: %d' % outcome
+                                for outcome in sorted(outcomes.items())
+                                ))
+
+    def moderation(self):
+        """Moderators going through the dashboard."""
+
+        moderator = User.objects.filter(
+                            username__startswith=self.options['prefix'],
+                            is_staff=True,
+                            ).first()
+        if moderator is None:
+            raise CommandError("no moderator, run ./manage.py generate_data")
+        sessions = self.sessions(
+                    [moderator.username] * min(self.options['concurrency'], 5)
+                        )
+        paths = [
+            reverse('openclass:moderation'),
+            reverse('openclass:moderation_workshops'),
+            reverse('openclass:moderation_accepted_workshops'),
+            reverse('openclass:moderation_done_workshops'),
+            reverse('openclass:moderation_submitted_workshops'),
+            reverse('openclass:moderation_attendance'),
+            ]
+        jobs = [
+            (self.random.choice(sessions), self.random.choice(paths),
+             None, False)
+            for i in range(self.options['requests'])
+            ]
+        self.run("moderation", jobs)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from openclass.models import Profile, Workshop
+from openclass import thumbnails
+
+
+class Command(BaseCommand):
+    help = "Make the thumbnails of the profile photos and workshop covers " \
+           "uploaded before the thumbnails, or of all of them with --all"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="also the images having thumbnails, the "
+                                 "existing files are kept")
+
+    def handle(self, *args, **options):
+        for model, field in ((Profile, 'photo'), (Workshop, 'cover_img')):
+            count = 0
+            for instance in model.objects.exclude(**{field: ''}).iterator():
+                image = getattr(instance, field)
+                if options['all'] or not thumbnails.is_current(
+                                            image,
+                                            instance.thumbnails_prefix,
+                                            ):
+                    instance.make_thumbnails()
+                    count += 1
+            self.stdout.write("%d %s thumbnail(s) made" % (
+                                count, model._meta.verbose_name))
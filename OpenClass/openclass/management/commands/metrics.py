@@ -0,0 +1,23 @@
+from urllib.request import urlopen
+from django.core.management.base import BaseCommand
+from openclass import metrics
+
+
+class Command(BaseCommand):
+    help = "Print the metrics in the Prometheus text format, read directly " \
+           "or scraped from a running server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help="scrape this /metrics/ url instead")
+        parser.add_argument('--reset', action='store_true',
+                            help="clear the counters and histograms")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            metrics.reset()
+        elif options['url']:
+            with urlopen(options['url'], timeout=10) as response:
+                self.stdout.write(response.read().decode(), ending='')
+        else:
+            self.stdout.write(metrics.render(), ending='')
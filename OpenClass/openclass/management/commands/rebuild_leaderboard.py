@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from openclass import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Reload the leaderboard from the members' scores in the database"
+
+    def handle(self, *args, **options):
+        count = leaderboard.rebuild()
+        self.stdout.write("%d member(s) ranked" % count)
@@ -0,0 +1,33 @@
+from django.db.models import F, Q
+from django.core.management.base import BaseCommand
+from openclass.models import Workshop
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized registration counters of workshops " \
+           "(accepted, pending, waitlisted and present). The PENDING " \
+           "registrations of FIFO workshops are moved to the waitlist and " \
+           "the free seats are given to it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('workshop_pk', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        workshops = Workshop.objects.all()
+        if options['workshop_pk']:
+            workshops = workshops.filter(pk__in=options['workshop_pk'])
+        waitlisted = Workshop.waitlist_pending(workshops)
+        count = Workshop.recount_registrations(workshops)
+        self.stdout.write("%d workshop(s) updated" % count)
+        if waitlisted:
+            self.stdout.write("%d pending registration(s) waitlisted" %
+                              waitlisted)
+
+        has_room = Q(seats_number=Workshop.INFINITE_SEATS_NB) | \
+                    Q(accepted_count__lt=F('seats_number'))
+        promoted = 0
+        for workshop in workshops.filter(has_room, waitlisted_count__gt=0):
+            promoted += workshop.promote_waitlist()
+        if promoted:
+            self.stdout.write("%d waitlisted registration(s) accepted" %
+                              promoted)
@@ -0,0 +1,83 @@
+import logging
+import time
+from django.core.mail import get_connection
+from django.db import close_old_connections
+from django.core.management.base import BaseCommand
+from openclass.models import OutgoingEmail
+from openclass import email
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Send the emails waiting in the outbox and the broadcasts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="keep polling the outbox")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="seconds between two polls of the outbox")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="emails sent per SMTP connection, "
+                                 "recipients per broadcast chunk")
+        parser.add_argument('--host', help="override settings.EMAIL_HOST")
+        parser.add_argument('--port', type=int,
+                            help="override settings.EMAIL_PORT")
+        parser.add_argument('--stats', action='store_true',
+                            help="only print the queue depth")
+
+    def get_connection(self, options):
+        if not options['host'] and not options['port']:
+            return get_connection()
+        # a local stand-in server, e.g. python -m smtpd -n -c DebuggingServer
+        return get_connection(
+                    'django.core.mail.backends.smtp.EmailBackend',
+                    host=options['host'] or 'localhost',
+                    port=options['port'] or 25,
+                    username='',
+                    password='',
+                    use_tls=False,
+                    )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write("queued: %d" % OutgoingEmail.queue_depth())
+            return
+
+        while True:
+            try:
+                self.send(options)
+            except Exception:
+                if not options['loop']:
+                    raise
+                # the worker outlives a database or SMTP server outage,
+                # what failed is sent again on the next poll
+                logger.exception("sending the outbox failed")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+            # as between two requests, a broken or expired database
+            # connection is opened again
+            close_old_connections()
+
+    def send(self, options):
+        # send batches until the due emails are exhausted
+        while True:
+            connection = self.get_connection(options)
+            sent, failed = email.send_queued_mail(
+                                        options['batch_size'],
+                                        connection,
+                                        )
+            if sent or failed:
+                self.stdout.write("sent: %d, failed: %d, queued: %d" % (
+                                        sent,
+                                        failed,
+                                        OutgoingEmail.queue_depth(),
+                                        ))
+            if sent + failed < options['batch_size']:
+                break
+
+        connection = self.get_connection(options)
+        sent = email.send_broadcasts(options['batch_size'], connection)
+        if sent:
+            self.stdout.write("broadcast sent: %d" % sent)
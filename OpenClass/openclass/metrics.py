@@ -0,0 +1,154 @@
+"""Application metrics in the Prometheus text format, served on /metrics/.
+
+Counters and histograms are accumulated in the process, then added every
+FLUSH_INTERVAL seconds to a hash of the shared redis cache, so the
+samples of all the gunicorn workers are summed. Gauges (outbox depth,
+database connections) are read when the endpoint is scraped.
+./manage.py metrics prints the same output without a running server."""
+
+import logging
+import re
+import time
+from collections import Counter, OrderedDict
+import redis
+from django.db import connection
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'openclass:metrics'
+FLUSH_INTERVAL = 5
+
+# name -> (type, help)
+METRICS = OrderedDict([
+    ('openclass_requests_total',
+        ('counter', "Requests by URL name, method and status")),
+    ('openclass_request_duration_seconds',
+        ('histogram', "Request duration by URL name")),
+    ('openclass_request_db_seconds',
+        ('histogram', "Time spent in SQL queries by URL name")),
+    ('openclass_request_queries',
+        ('histogram', "SQL queries per request by URL name")),
+    ('openclass_cache_hits_total',
+        ('counter', "Cache hits while serving requests")),
+    ('openclass_cache_misses_total',
+        ('counter', "Cache misses while serving requests")),
+    ('openclass_registrations_total',
+        ('counter', "Workshop registration attempts by outcome")),
+    ('openclass_checkins_total',
+        ('counter', "Self check-ins at the door by status")),
+    ('openclass_outbox_depth',
+        ('gauge', "Emails waiting in the outbox")),
+    ('openclass_pending_broadcasts',
+        ('gauge', "Email broadcasts not done yet")),
+    ('openclass_db_connections',
+        ('gauge', "Open connections to the database")),
+])
+
+_pending = Counter()
+_last_flush = time.monotonic()
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+                '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                                             .replace('"', r'\"')
+                                             .replace('\n', r'\n'))
+                for name, value in sorted(labels.items())
+                )
+
+def inc_counter(name, labels=None, amount=1):
+    _pending[name + format_labels(labels)] += amount
+
+def observe_histogram(name, labels, value, buckets):
+    """Add an observation to the cumulative buckets of a histogram."""
+
+    labels = labels or {}
+    for bound in buckets:
+        if value <= bound:
+            _pending[name + '_bucket' + format_labels(dict(labels, le=bound))] += 1
+    _pending[name + '_bucket' + format_labels(dict(labels, le='+Inf'))] += 1
+    _pending[name + '_sum' + format_labels(labels)] += value
+    _pending[name + '_count' + format_labels(labels)] += 1
+
+def flush(force=False):
+    """Add the samples of this process to the shared ones, at most every
+    FLUSH_INTERVAL seconds unless forced."""
+
+    global _last_flush
+    now = time.monotonic()
+    if not _pending or (not force and now - _last_flush < FLUSH_INTERVAL):
+        return
+    _last_flush = now
+    samples = list(_pending.items())
+    _pending.clear()
+    try:
+        pipe = get_redis_connection().pipeline(transaction=False)
+        for sample, value in samples:
+            pipe.hincrbyfloat(METRICS_KEY, sample, value)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("can't flush %d metric samples", len(samples))
+
+def gauges():
+    from .models import OutgoingEmail, EmailBroadcast
+
+    values = {
+        'openclass_outbox_depth': OutgoingEmail.queue_depth(),
+        'openclass_pending_broadcasts':
+            EmailBroadcast.pending().count(),
+    }
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database()"
+                )
+            values['openclass_db_connections'] = cursor.fetchone()[0]
+    return values
+
+def sort_key(sample):
+    """Order the samples by labels, then the buckets by bound."""
+
+    name, _, labels = sample[0].partition('{')
+    bound = re.search(r'le="([^"]*)"', labels)
+    bound = float(bound.group(1)) if bound else 0
+    return re.sub(r',?le="[^"]*"', '', labels), name, bound
+
+def format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def render():
+    """Get all the metrics in the Prometheus text exposition format."""
+
+    flush(force=True)
+    try:
+        stored = get_redis_connection().hgetall(METRICS_KEY)
+    except redis.RedisError:
+        logger.warning("can't read the metrics")
+        stored = {}
+    samples = {key.decode(): value.decode() for key, value in stored.items()}
+    samples.update(gauges())
+
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        metric_samples = sorted(
+                            ((sample, value) for sample, value in samples.items()
+                             if sample.split('{')[0] in (
+                                name, name + '_bucket',
+                                name + '_sum', name + '_count')),
+                            key=sort_key,
+                            )
+        if not metric_samples:
+            continue
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for sample, value in metric_samples:
+            lines.append('%s %s' % (sample, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    _pending.clear()
+    get_redis_connection().delete(METRICS_KEY)
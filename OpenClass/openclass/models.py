@@ -1,17 +1,55 @@
 import re
-import random
+import secrets
+from collections import namedtuple
 from django.db import models, transaction, DatabaseError
-from django.db.models import Q
+from django.db.models import Q, F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
+from django.core import signing
 from constance import config
 from .upload import *
 from .validators import *
 from . import email
-
-from datetime import datetime
+from . import leaderboard
+from . import metrics
+from . import pagecache
+from . import search
+from . import thumbnails
+
+from datetime import datetime, timedelta
+
+
+class WorkshopManager(models.Manager):
+    STATUS_COUNTS_CACHE_KEY = 'openclass:workshop_status_counts'
+    STATUS_COUNTS_CACHE_TIMEOUT = 60
+
+    def status_counts(self):
+        """Get the number of workshops per status with one GROUP BY query,
+        cached for a short time."""
+
+        counts = cache.get(self.STATUS_COUNTS_CACHE_KEY)
+        if counts is None:
+            counts = dict.fromkeys(dict(self.model.STATUS_CHOICES), 0)
+            rows = self.order_by().values_list('status')
+            counts.update(rows.annotate(count=Count('pk')))
+            cache.set(
+                self.STATUS_COUNTS_CACHE_KEY,
+                counts,
+                self.STATUS_COUNTS_CACHE_TIMEOUT,
+                )
+        return counts
+
+    def clear_status_counts(self):
+        # once committed, or a concurrent read could cache the old counts
+        transaction.on_commit(
+            lambda: cache.delete(self.STATUS_COUNTS_CACHE_KEY)
+            )
 
 
 class Workshop(models.Model):
@@ -39,6 +77,14 @@ class Workshop(models.Model):
         (CANCELED, 'Canceled'),
     )
     DEFAULT_PHOTO = "default/default-workshop.jpg"
+    # resized versions of the cover, see thumbnails.py
+    COVER_SIZES = {
+        'card': thumbnails.Size(640, 480, False),
+        'large': thumbnails.Size(1280, 720, False),
+    }
+    # the door scanners prove they are ours with the key of the workshop
+    DOOR_KEY_SALT = 'openclass.workshop.door'
+    DOOR_KEY_MAX_AGE = timedelta(days=1)
 
     registered = models.ManyToManyField(
                                 'Profile',
@@ -78,50 +124,225 @@ class Workshop(models.Model):
                         upload_to=upload_to_workshop_cover,
                         default=DEFAULT_PHOTO,
                         )
+    thumbnails_prefix = models.CharField(
+                        max_length=255,
+                        blank=True,
+                        editable=False,
+                        )
     status = models.CharField(
                     max_length=1,
                     choices=STATUS_CHOICES,
-                    default=PENDING,
-                    db_index=True)
+                    default=PENDING)
+    # denormalized number of ACCEPTED registrations, updated through
+    # take_seat()/release_seat() so concurrent registrations can't oversell
+    # (see Registration.save())
+    accepted_count = models.PositiveIntegerField(default=0)
+    # the other denormalized counters of registrations, updated along with
+    # them (see Registration.save())
+    pending_count = models.PositiveIntegerField(default=0)
+    waitlisted_count = models.PositiveIntegerField(default=0)
+    present_count = models.PositiveIntegerField(default=0)
+    # full text search document of title, description and objectives
+    search_vector = SearchVectorField(null=True, editable=False)
+    # fields maintained with UPDATE queries, not written by save()
+    MAINTAINED_FIELDS = ('accepted_count', 'pending_count', 'waitlisted_count',
+                         'present_count', 'search_vector', 'thumbnails_prefix')
+
+    objects = WorkshopManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            # keyset pagination of the workshop lists
+            models.Index(fields=['start_date', 'id']),
+            # the same for a status (upcoming ACCEPTED, moderation lists),
+            # also serves the lookups on the status alone
+            models.Index(fields=['status', 'start_date', 'id']),
+        ]
 
     def __str__(self):
         return "[%02d] %s" % (self.pk, self.title)
 
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        # never write back counters that may have changed since the load
+        if not created and not kwargs.get('update_fields') \
+                and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                        field.name for field in self._meta.concrete_fields
+                        if not field.primary_key
+                        and field.name not in Workshop.MAINTAINED_FIELDS
+                        ]
+        uploaded = not self.cover_img._committed
+        super().save(*args, **kwargs)
+        search.update_search_vector(Workshop.objects.filter(pk=self.pk))
+        if uploaded:
+            self.make_thumbnails()
+
+    @staticmethod
+    def changed(sender, **kwargs):
+        """post_save and post_delete: drop the cached status counts, the
+        admin edits included."""
+
+        Workshop.objects.clear_status_counts()
+
+    def make_thumbnails(self):
+        self.thumbnails_prefix = thumbnails.generate(
+                                        self.cover_img,
+                                        Workshop.COVER_SIZES,
+                                        )
+        Workshop.objects.filter(pk=self.pk).update(
+                                thumbnails_prefix=self.thumbnails_prefix
+                                )
+
+    def cover_thumbnails(self):
+        """Get the {size name: thumbnails.Thumbnail} of the cover."""
+
+        return thumbnails.get_thumbnails(
+                                self.cover_img,
+                                self.thumbnails_prefix,
+                                Workshop.COVER_SIZES,
+                                )
+
 
     def end_date(self):
         return self.start_date + self.duration
 
+    def is_in_progress(self):
+        return self.start_date <= timezone.now() <= self.end_date()
+
+    def door_key(self):
+        """Get a key for the door scanners of the workshop, shown to the
+        moderators on its attendance page."""
+
+        return signing.dumps(self.pk, salt=Workshop.DOOR_KEY_SALT)
+
+    @staticmethod
+    def read_door_key(key):
+        """Get the workshop pk of a door key.
+        Raise signing.BadSignature if it wasn't signed by us or expired."""
+
+        return signing.loads(key,
+                             salt=Workshop.DOOR_KEY_SALT,
+                             max_age=Workshop.DOOR_KEY_MAX_AGE)
+
     def count_registrations(self):
-        count = Registration.objects.filter(workshop=self).count()
-        return count
+        """Get the number of registrations not canceled nor refused."""
+
+        return self.accepted_count + self.pending_count + \
+               self.waitlisted_count
 
     def count_presents(self):
-        count = Registration.objects.filter(
-                                    workshop=self,
-                                    present=True
-                                    ).count()
-        return count
+        return self.present_count
+
+    def seats_left(self):
+        if self.seats_number == Workshop.INFINITE_SEATS_NB:
+            return None
+        return max(self.seats_number - self.accepted_count, 0)
+
+    def fill_rate(self):
+        """Get the percentage of the seats taken, None if infinite."""
+
+        if self.seats_number == Workshop.INFINITE_SEATS_NB:
+            return None
+        return min(100 * self.accepted_count // self.seats_number, 100)
+
+    def take_seat(self):
+        """Atomically reserve a seat using a conditional UPDATE.
+        The row lock is held by the UPDATE until the end of the current
+        transaction, the seat count is never read then written back."""
+
+        has_room = Q(seats_number=Workshop.INFINITE_SEATS_NB) | \
+                    Q(accepted_count__lt=F('seats_number'))
+        updated = Workshop.objects.filter(has_room, pk=self.pk).update(
+                                    accepted_count=F('accepted_count') + 1
+                                    )
+        if updated:
+            self.accepted_count += 1
+            if self.seats_left() == 0:
+                # the lists show the full workshops
+                pagecache.invalidate('workshops')
+            return True
+        else:
+            return False
+
+    def release_seat(self):
+        updated = Workshop.objects.filter(
+                                    pk=self.pk,
+                                    accepted_count__gt=0,
+                                    ).update(
+                                    accepted_count=F('accepted_count') - 1
+                                    )
+        if updated:
+            if self.seats_left() == 0:
+                pagecache.invalidate('workshops')
+            self.accepted_count -= 1
+        return bool(updated)
+
+    @staticmethod
+    def update_counters(workshop_pk, changes):
+        """Add the {counter field: delta} changes to the counters of a
+        workshop with a single UPDATE."""
+
+        changes = {
+            field: F(field) + delta
+            for field, delta in changes.items() if delta
+            }
+        if changes:
+            Workshop.objects.filter(pk=workshop_pk).update(**changes)
+
+    @staticmethod
+    def recount_registrations(workshops):
+        """Recompute the denormalized counters of a Workshop queryset
+        from the registrations, in a single UPDATE statement."""
+
+        def count(**filters):
+            registrations = Registration.objects.filter(
+                                        workshop=OuterRef('pk'),
+                                        **filters
+                                        ).order_by().values('workshop')
+            registrations = registrations.annotate(count=Count('pk'))
+            registrations = Subquery(
+                                registrations.values('count'),
+                                output_field=models.IntegerField(),
+                                )
+            return Coalesce(registrations, 0)
+
+        return workshops.update(
+                    accepted_count=count(status=Registration.ACCEPTED),
+                    pending_count=count(status=Registration.PENDING),
+                    waitlisted_count=count(status=Registration.WAITLISTED),
+                    present_count=count(present=True),
+                    )
 
     def register(self, profile):
         registration = Registration(workshop=self, profile=profile)
+        profile.forget_registration_state(self)
         if self.registration_politic == Workshop.POL_FIFO:
-            if self.seats_number == Workshop.INFINITE_SEATS_NB :
-                registration.accept() #save
-                return True
-            else:
-                try:
-                    with transaction.atomic():
-                        count = Registration.objects.filter(
-                                            workshop=self,
-                                            status=Registration.ACCEPTED,
-                                            ).count()
-                        if count + 1 <= self.seats_number:
-                            registration.accept()
-                        else: # accept cause a save()
-                            registration.save()
-                        return True
-                except DatabaseError:
-                    return False
+            try:
+                with transaction.atomic():
+                    # the seat stays locked until the registration is saved
+                    has_seat = self.take_seat()
+                    if not has_seat:
+                        # a failed UPDATE locks nothing: lock the row so a
+                        # cancel either frees its seat before or sees this
+                        # registration on the waitlist after
+                        self.lock()
+                        has_seat = self.take_seat()
+                    if has_seat:
+                        registration.accept(count_seat=False)
+                        outcome = 'accepted'
+                    else: # accept cause a save()
+                        registration.status = Registration.WAITLISTED
+                        registration.save()
+                        outcome = 'waitlisted'
+            except DatabaseError:
+                outcome = 'error'
+            metrics.inc_counter(
+                        'openclass_registrations_total',
+                        {'outcome': outcome},
+                        )
+            return outcome != 'error'
 
     def is_registration_open(self):
         if timezone.now() > self.last_registration_date():
@@ -135,20 +356,106 @@ class Workshop(models.Model):
         return date
 
     def cancel_registration(self, profile):
-        try:
-            registration = Registration.objects.get(
-                                    profile=profile,
-                                    workshop=self,
-                                    )
-        except Registration.DoesNotExist:
-            return False
-        if registration.status == Registration.CANCELED:
-            return False
-        else:
+        profile.forget_registration_state(self)
+        with transaction.atomic():
+            # the workshop row is locked before the waitlist is read: a
+            # concurrent register() waits for it and can't be left on the
+            # waitlist while the seat it missed is released
+            self.lock()
+            try:
+                registration = Registration.objects.get(
+                                        profile=profile,
+                                        workshop=self,
+                                        )
+            except Registration.DoesNotExist:
+                return False
+            if registration.status == Registration.CANCELED:
+                return False
+            was_accepted = registration.status == Registration.ACCEPTED
             registration.date_cancel = timezone.now()
             registration.status = Registration.CANCELED
-            registration.save()
-            return True
+            registration.save(count_seat=False)
+            if was_accepted:
+                # hand the seat over to the head of the waitlist
+                if not self.promote_waitlist_head():
+                    self.release_seat()
+        return True
+
+    def lock(self):
+        """Lock the workshop row until the end of the transaction, no seat
+        can be taken or released by the others meanwhile."""
+
+        Workshop.objects.select_for_update().filter(
+                                    pk=self.pk,
+                                    ).values_list('pk', flat=True).get()
+
+    def waitlist(self):
+        """Get the WAITLISTED registrations in the order of promotion."""
+
+        waitlist = Registration.objects.filter(
+                                    workshop=self,
+                                    status=Registration.WAITLISTED,
+                                    ).order_by('date_registration', 'pk')
+        return waitlist
+
+    def promote_waitlist_head(self):
+        """Accept the first waitlisted registration, the seat is
+        transferred so accepted_count is left unchanged.
+        Must be called inside a transaction."""
+
+        # a head locked by a concurrent cancel is skipped, not waited for
+        head = self.waitlist().select_for_update(skip_locked=True).first()
+        if head is None:
+            return None
+        head.accept(count_seat=False)
+        return head
+
+    def promote_waitlist(self):
+        """Accept as many waitlisted registrations as there are free seats,
+        using a fixed number of queries whatever the waitlist length."""
+
+        with transaction.atomic():
+            # lock the workshop row, no seat can be taken meanwhile
+            workshop = Workshop.objects.select_for_update().get(pk=self.pk)
+            waitlist = self.waitlist().select_for_update(skip_locked=True)
+            seats_left = workshop.seats_left()
+            if seats_left is not None:
+                waitlist = waitlist[:seats_left]
+            promoted = list(waitlist.values_list('pk', flat=True))
+            if promoted:
+                Registration.objects.filter(pk__in=promoted).update(
+                                    status=Registration.ACCEPTED
+                                    )
+                Workshop.update_counters(self.pk, {
+                                    'accepted_count': len(promoted),
+                                    'waitlisted_count': -len(promoted),
+                                    })
+                pagecache.invalidate('workshops')
+            self.accepted_count = workshop.accepted_count + len(promoted)
+            self.waitlisted_count = workshop.waitlisted_count - len(promoted)
+            if settings.EMAIL_ENABLED and promoted:
+                registrations = Registration.objects.filter(pk__in=promoted)
+                registrations = registrations.select_related(
+                                    'workshop',
+                                    'profile__user',
+                                    'profile__preference',
+                                    )
+                for registration in registrations:
+                    registration.notify_acceptance()
+        return len(promoted)
+
+    @staticmethod
+    def waitlist_pending(workshops):
+        """Move the PENDING registrations of the FIFO workshops of a
+        queryset to their waitlist. FIFO registrations used to stay
+        PENDING when there was no seat left."""
+
+        return Registration.objects.filter(
+                    workshop__in=workshops.filter(
+                                registration_politic=Workshop.POL_FIFO,
+                                ),
+                    status=Registration.PENDING,
+                    ).update(status=Registration.WAITLISTED)
 
 
     def last_cancel_date(self):
@@ -198,8 +505,11 @@ class Workshop(models.Model):
 
     def update_seats_number(self, new_seats_number):
         if new_seats_number > 0:
-            self.seats_number = new_seats_number
-            self.save()
+            with transaction.atomic():
+                self.seats_number = new_seats_number
+                self.save()
+                # raising the seats number frees seats for the waitlist
+                self.promote_waitlist()
             return True
         else:
             return False
@@ -285,22 +595,6 @@ class Workshop(models.Model):
             addend = 1
         return time_left.days + addend  # return only days left
 
-    def check_registration(self, profile):
-        flags = {}
-        try:
-            registration = Registration.objects.get(
-                                    profile=profile,
-                                    workshop=self,
-                                    )
-        except:
-            return flags
-        flags['is_pending'] = registration.status == Registration.PENDING
-        flags['is_accepted'] = registration.status == Registration.ACCEPTED
-        flags['is_refused'] = registration.status == Registration.REFUSED
-        flags['is_canceled'] = registration.status == Registration.CANCELED
-
-        return flags
-
     def is_now(self):
         start_date = self.start_date
         end_date = start_date + self.duration
@@ -309,20 +603,69 @@ class Workshop(models.Model):
         else:
             return False
 
+    def mark_attendance(self, profile_pks, present=True):
+        """Mark the ACCEPTED registrations of the profiles present (or
+        absent) with one UPDATE, and credit the attendance points of the
+        newly present members at once.
+        Get the pks of the profiles whose presence changed, None if the
+        workshop hasn't started."""
+
+        if not self.is_now():
+            return None
+        with transaction.atomic():
+            # locked so concurrent check-ins can't credit twice
+            registrations = Registration.objects.select_for_update().filter(
+                                    workshop=self,
+                                    profile__in=list(profile_pks),
+                                    status=Registration.ACCEPTED,
+                                    present=not present,
+                                    )
+            changed = list(registrations.values_list('pk', 'profile'))
+            Registration.objects.filter(
+                                pk__in=[pk for pk, profile_pk in changed]
+                                ).update(present=present)
+            changed = [profile_pk for pk, profile_pk in changed]
+            delta = len(changed) if present else -len(changed)
+            Workshop.update_counters(self.pk, {'present_count': delta})
+            self.present_count += delta
+            if present and changed:
+                Profile.gain_points_many(changed, config.POINTS_ATTENDANCE)
+        return changed
+
 class Registration(models.Model):
     PENDING = 'P'
     ACCEPTED = 'A'
     REFUSED = 'R'
     CANCELED = 'C'
+    WAITLISTED = 'W'
     STATUS_CHOICES = (
         (PENDING, 'Pending'),
         (ACCEPTED, 'Accepted'),
         (REFUSED, 'Refused'),
         (CANCELED, 'Canceled'),
+        (WAITLISTED, 'Waitlisted'),
     )
-
-    workshop = models.ForeignKey('Workshop', on_delete=models.CASCADE)
-    profile = models.ForeignKey('Profile', on_delete=models.CASCADE)
+    # Workshop counter of each status, the ACCEPTED registrations are
+    # counted along with the seats (see save())
+    STATUS_COUNTERS = {
+        PENDING: 'pending_count',
+        WAITLISTED: 'waitlisted_count',
+    }
+    CHECKIN_SALT = 'openclass.registration.checkin'
+    # a fresh token is shown on every visit of the registrations page
+    CHECKIN_MAX_AGE = timedelta(days=30)
+
+    # no index of their own, the composite indexes start with them
+    workshop = models.ForeignKey(
+                        'Workshop',
+                        on_delete=models.CASCADE,
+                        db_index=False,
+                        )
+    profile = models.ForeignKey(
+                        'Profile',
+                        on_delete=models.CASCADE,
+                        db_index=False,
+                        )
     status = models.CharField(
                 max_length=1,
                 choices=STATUS_CHOICES,
@@ -334,11 +677,134 @@ class Registration(models.Model):
 
     class Meta:
         unique_together = (('workshop', 'profile'),)
+        indexes = [
+            # waitlist head lookup and positions, seats counting
+            models.Index(fields=['workshop', 'status', 'date_registration']),
+            # attendance
+            models.Index(fields=['workshop', 'present']),
+            # registrations and attended workshops of a member
+            models.Index(fields=['profile', 'status']),
+        ]
 
     def __str__(self):
         return "[%02d] %s -> %s <%s>" % (self.pk, self.profile, self.workshop,
                                         self.status)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        registration = super().from_db(db, field_names, values)
+        # the state the workshop counters include
+        if 'status' in field_names and 'present' in field_names:
+            registration._counted = (registration.status, registration.present)
+        return registration
+
+    @staticmethod
+    def counter_changes(old, new):
+        """Get the {counter field: delta} of the workshop for a registration
+        going from the (status, present) old to new, None for none."""
+
+        changes = {}
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            status, present = state
+            if status in Registration.STATUS_COUNTERS:
+                field = Registration.STATUS_COUNTERS[status]
+                changes[field] = changes.get(field, 0) + sign
+            if present:
+                changes['present_count'] = \
+                                changes.get('present_count', 0) + sign
+        return changes
+
+    def save(self, *args, count_seat=True, **kwargs):
+        """Save the registration and update the counters of its workshop.
+        A registration entering or leaving ACCEPTED takes or releases a
+        seat, unless count_seat is False: the caller moved the seat itself,
+        register() takes it beforehand and a cancel hands it over to the
+        head of the waitlist."""
+
+        new = (self.status, self.present)
+        # no savepoint, a failure has to roll the caller back anyway
+        with transaction.atomic(savepoint=False):
+            if self._state.adding:
+                old = None
+            elif hasattr(self, '_counted'):
+                old = self._counted
+            else: # loaded with deferred fields
+                old = Registration.objects.filter(pk=self.pk).values_list(
+                                                'status', 'present').first()
+            super().save(*args, **kwargs)
+            changes = Registration.counter_changes(old, new) \
+                      if old != new else {}
+            was_accepted = old is not None and old[0] == Registration.ACCEPTED
+            is_accepted = self.status == Registration.ACCEPTED
+            if count_seat and is_accepted and not was_accepted:
+                # a moderator may accept beyond the seats, still counted
+                if not self.workshop.take_seat():
+                    changes['accepted_count'] = 1
+            elif count_seat and was_accepted and not is_accepted:
+                self.workshop.release_seat()
+            Workshop.update_counters(self.workshop_id, changes)
+        self._counted = new
+
+    @staticmethod
+    def deleted(sender, instance, **kwargs):
+        """post_delete: take a registration out of the workshop counters,
+        cascades included."""
+
+        changes = Registration.counter_changes(
+                            (instance.status, instance.present),
+                            None,
+                            )
+        if instance.status == Registration.ACCEPTED:
+            changes['accepted_count'] = -1
+            # the freed seat goes to the head of the waitlist, like a cancel
+            workshop_pk = instance.workshop_id
+            transaction.on_commit(
+                lambda: Registration.promote_after_delete(workshop_pk)
+                )
+        Workshop.update_counters(instance.workshop_id, changes)
+
+    @staticmethod
+    def promote_after_delete(workshop_pk):
+        # gone when the workshop itself was deleted
+        workshop = Workshop.objects.filter(pk=workshop_pk).first()
+        if workshop is not None and workshop.waitlisted_count:
+            workshop.promote_waitlist()
+
+    def checkin_token(self):
+        """Get the signed check-in token of the registration, verified at
+        the door without any lookup."""
+
+        return signing.dumps([self.workshop_id, self.profile_id],
+                             salt=Registration.CHECKIN_SALT)
+
+    @staticmethod
+    def read_checkin_token(token):
+        """Get the (workshop pk, profile pk) of a check-in token.
+        Raise signing.BadSignature if it wasn't signed by us or expired."""
+
+        workshop_pk, profile_pk = signing.loads(
+                                        token,
+                                        salt=Registration.CHECKIN_SALT,
+                                        max_age=Registration.CHECKIN_MAX_AGE,
+                                        )
+        return workshop_pk, profile_pk
+
+    def waitlist_position(self):
+        """Get the 1-based position in the workshop's waitlist."""
+
+        if self.status != Registration.WAITLISTED:
+            return None
+        before = Q(date_registration__lt=self.date_registration) | \
+                    Q(date_registration=self.date_registration, pk__lt=self.pk)
+        ahead = Registration.objects.filter(
+                                    before,
+                                    workshop_id=self.workshop_id,
+                                    status=Registration.WAITLISTED,
+                                    ).count()
+        return ahead + 1
+
     def confirm_presence(self):
         if self.workshop.is_now():
             self.present = True
@@ -357,15 +823,18 @@ class Registration(models.Model):
         else:
             return False
 
-    def accept(self):
-        if settings.EMAIL_ENABLED:
-            if self.profile.preference.notify_registration_status:
-                email.notify_registration_acceptance(
-                                        self.workshop,
-                                        self.profile.user
-                                        )
+    def accept(self, count_seat=True):
         self.status = Registration.ACCEPTED
-        self.save()
+        self.save(count_seat=count_seat)
+        if settings.EMAIL_ENABLED:
+            self.notify_acceptance()
+
+    def notify_acceptance(self):
+        if self.profile.preference.notify_registration_status:
+            email.notify_registration_acceptance(
+                                    self.workshop,
+                                    self.profile.user
+                                    )
 
     def refuse(self):
         if settings.EMAIL_ENABLED:
@@ -377,6 +846,45 @@ class Registration(models.Model):
         self.status = Registration.REFUSED
         self.save()
 
+class RegistrationState(namedtuple('RegistrationState',
+                                     ('status', 'waitlist_position'))):
+    """The registration of a member to a workshop as the pages show it,
+    status is None when the member isn't registered.
+    See Profile.registration_state()."""
+
+    __slots__ = ()
+    # the registrations a member can still cancel
+    CANCELABLE = (Registration.ACCEPTED, Registration.PENDING,
+                  Registration.WAITLISTED)
+
+    @property
+    def is_registered(self):
+        return self.status is not None
+
+    @property
+    def is_pending(self):
+        return self.status == Registration.PENDING
+
+    @property
+    def is_accepted(self):
+        return self.status == Registration.ACCEPTED
+
+    @property
+    def is_refused(self):
+        return self.status == Registration.REFUSED
+
+    @property
+    def is_canceled(self):
+        return self.status == Registration.CANCELED
+
+    @property
+    def is_waitlisted(self):
+        return self.status == Registration.WAITLISTED
+
+    @property
+    def is_cancelable(self):
+        return self.status in RegistrationState.CANCELABLE
+
 class Question(models.Model):
     author = models.ForeignKey(
                     'Profile',
@@ -403,6 +911,23 @@ class Feedback(models.Model):
     def __str__(self):
         return "[%02d] %s -> %s" % (self.pk, self.author, self.workshop.title)
 
+    def add_answers(self, answers):
+        """Save the answers {mc_question pk: choice pk} to the questions of
+        the workshop, with one query to validate them all and one
+        INSERT. The answers to other questions or with choices of
+        another question are ignored. Get the number of answers saved."""
+
+        questions = dict(Choice.objects.filter(
+                                question__workshop=self.workshop_id,
+                                ).values_list('pk', 'question'))
+        choices = [
+            Feedback.choices.through(feedback=self, choice_id=choice_pk)
+            for question_pk, choice_pk in answers.items()
+            if questions.get(choice_pk) == question_pk
+            ]
+        Feedback.choices.through.objects.bulk_create(choices)
+        return len(choices)
+
 #Multiple Choice Question
 class MCQuestion(models.Model):
     MAX_LEN_QST = 80
@@ -440,6 +965,45 @@ class Tag(models.Model):
     def __str__(self):
         return "#%s" % (self.name)
 
+class ProfileManager(models.Manager):
+
+    def with_page_data(self):
+        """Get the profiles along with everything their page shows, in a
+        fixed number of queries whatever the number of profiles:
+
+        - attended_registrations: the ACCEPTED and present registrations,
+          with their workshop
+        - animated_workshops: the DONE workshops animated
+        - badge_list: the Have_badge, with their badge, by priority
+        - the links and the interests"""
+
+        attended = Registration.objects.filter(
+                            status=Registration.ACCEPTED,
+                            present=True,
+                            ).select_related('workshop')
+        animated = Workshop.objects.filter(status=Workshop.DONE)
+        badges = Have_badge.objects.select_related('badge')
+        return self.select_related('user', 'preference').prefetch_related(
+                models.Prefetch(
+                    'registration_set',
+                    queryset=attended.order_by('-workshop__start_date'),
+                    to_attr='attended_registrations',
+                    ),
+                models.Prefetch(
+                    'animated',
+                    queryset=animated.order_by('-start_date'),
+                    to_attr='animated_workshops',
+                    ),
+                models.Prefetch(
+                    'have_badge_set',
+                    queryset=badges.order_by('priority', 'pk'),
+                    to_attr='badge_list',
+                    ),
+                'link_set',
+                'interests',
+                )
+
+
 class Profile(models.Model):
     RE_PHONE_NB = r"^(\+[\d ]{3})?[\d ]+$"
     MAX_LEN_PHONE_NB = 20
@@ -452,6 +1016,11 @@ class Profile(models.Model):
         (NAG, 'Not mentioned')
     )
     DEFAULT_PHOTO = "default/default-avatar.png"
+    # resized versions of the photo, see thumbnails.py
+    PHOTO_SIZES = {
+        'small': thumbnails.Size(128, 128, True),
+        'medium': thumbnails.Size(256, 256, True),
+    }
 
     badges = models.ManyToManyField('Badge', through='Have_badge')
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -466,17 +1035,80 @@ class Profile(models.Model):
                     upload_to=upload_to_profile_photo,
                     default=DEFAULT_PHOTO,
                     )
+    thumbnails_prefix = models.CharField(
+                    max_length=255,
+                    blank=True,
+                    editable=False,
+                    )
+
+    objects = ProfileManager()
 
     def __str__(self):
         return "[%02d] %s" % (self.pk, self.user)
 
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        uploaded = not self.photo._committed
+        super().save(*args, **kwargs)
+        if uploaded:
+            self.make_thumbnails()
+        if created:
+            transaction.on_commit(
+                lambda: leaderboard.add_member(self.pk, self.score)
+                )
+
+    @staticmethod
+    def deleted(sender, instance, **kwargs):
+        """post_delete: take the member out of the leaderboard, the
+        deletion of the user included."""
+
+        # the instance loses its pk once deleted
+        profile_pk = instance.pk
+        transaction.on_commit(lambda: leaderboard.remove_member(profile_pk))
+
+    def make_thumbnails(self):
+        self.thumbnails_prefix = thumbnails.generate(
+                                        self.photo,
+                                        Profile.PHOTO_SIZES,
+                                        )
+        Profile.objects.filter(pk=self.pk).update(
+                                thumbnails_prefix=self.thumbnails_prefix
+                                )
+
+    def photo_thumbnails(self):
+        """Get the {size name: thumbnails.Thumbnail} of the photo."""
+
+        return thumbnails.get_thumbnails(
+                                self.photo,
+                                self.thumbnails_prefix,
+                                Profile.PHOTO_SIZES,
+                                )
+
+    def gain_points(self, points):
+        # computed by the database: concurrent gains can't overwrite each
+        # other and the rest of the row isn't rewritten
+        Profile.objects.filter(pk=self.pk).update(score=F('score') + points)
+        self.score += points
+        transaction.on_commit(lambda: leaderboard.add_points(self.pk, points))
+
+    @staticmethod
+    def gain_points_many(profile_pks, points):
+        """Give the same points to many profiles in a single UPDATE."""
+
+        profile_pks = list(profile_pks)
+        count = Profile.objects.filter(pk__in=profile_pks).update(
+                                            score=F('score') + points
+                                            )
+        transaction.on_commit(
+            lambda: leaderboard.add_points_many(profile_pks, points)
+            )
+        return count
+
     def gain_attendance_points(self):
-        self.score += config.POINTS_ATTENDANCE
-        self.save()
+        self.gain_points(config.POINTS_ATTENDANCE)
 
     def gain_animation_points(self):
-        self.score += config.POINTS_ANIMATION
-        self.save()
+        self.gain_points(config.POINTS_ANIMATION)
 
     def generate_verification_token(self):
         try:
@@ -488,33 +1120,41 @@ class Profile(models.Model):
         #render and send email
         return token
 
-    def is_registered(self, workshop):
-        try:
-            registration = Registration.objects.get(
-                                    profile=self,
-                                    workshop=workshop,
-                                    )
-            return True
-        except Registration.DoesNotExist:
-            return False
+    def registration_state(self, workshop):
+        """Get the RegistrationState of the profile for a workshop.
 
-    def can_cancel_registration(self, workshop):
-        if timezone.now() > workshop.last_cancel_date():
-            return False
+        It is looked up once and kept on the profile, so the view, the
+        template and the endpoints of a request share a single query;
+        Workshop.register() and cancel_registration() forget it."""
 
-        try:
-            registration = Registration.objects.get(
+        if not hasattr(self, '_registration_states'):
+            self._registration_states = {}
+        states = self._registration_states
+        if workshop.pk not in states:
+            registration = Registration.objects.filter(
                                     profile=self,
                                     workshop=workshop,
+                                    ).first()
+            if registration is None:
+                states[workshop.pk] = RegistrationState(None, None)
+            else:
+                states[workshop.pk] = RegistrationState(
+                                    registration.status,
+                                    registration.waitlist_position(),
                                     )
-        except Registration.DoesNotExist:
-            return False
+        return states[workshop.pk]
 
-        if registration.status == Registration.ACCEPTED or \
-            registration.status == Registration.PENDING:
-            return True
-        else:
+    def forget_registration_state(self, workshop):
+        if hasattr(self, '_registration_states'):
+            self._registration_states.pop(workshop.pk, None)
+
+    def is_registered(self, workshop):
+        return self.registration_state(workshop).is_registered
+
+    def can_cancel_registration(self, workshop):
+        if timezone.now() > workshop.last_cancel_date():
             return False
+        return self.registration_state(workshop).is_cancelable
 
     def update_email(self, email):
         """Update the user's email only if it is valid.
@@ -633,7 +1273,8 @@ class Profile(models.Model):
 class VerificationToken(models.Model):
     TOKEN_LEN = 32
 
-    value = models.CharField(max_length=TOKEN_LEN)
+    # 128 random bits, a collision is left to the unique index
+    value = models.CharField(max_length=TOKEN_LEN, unique=True)
     profile = models.OneToOneField(
                             Profile,
                             related_name='verification_token',
@@ -641,20 +1282,32 @@ class VerificationToken(models.Model):
                             unique=True
                             )
 
-    def generate_new_token(self):
-        TOKEN_LEN = VerificationToken.TOKEN_LEN
-        CHOICES = "ABCDEF0123456789abcdefg"
-        while True:
-            token = [random.choice(CHOICES) for i in range(TOKEN_LEN)]
-            self.value = "".join(token)
-            try: #make sure the token is unique
-                v = VerificationToken.objects.get(value=self.value)
-            except VerificationToken.DoesNotExist:
-                break
+    @staticmethod
+    def new_value():
+        return secrets.token_hex(VerificationToken.TOKEN_LEN // 2)
 
+    def generate_new_token(self):
+        self.value = VerificationToken.new_value()
         self.save()
         return self.value
 
+    @staticmethod
+    def generate_many(profiles):
+        """Give new tokens to many profiles with a single INSERT, their
+        previous tokens are deleted. Get the {profile pk: token}."""
+
+        tokens = [
+            VerificationToken(profile=profile,
+                              value=VerificationToken.new_value())
+            for profile in profiles
+            ]
+        with transaction.atomic(savepoint=False):
+            VerificationToken.objects.filter(
+                        profile__in=[token.profile for token in tokens]
+                        ).delete()
+            VerificationToken.objects.bulk_create(tokens)
+        return {token.profile.pk: token.value for token in tokens}
+
     def verify(self, token):
         if token == self.value :
             self.profile.user.is_active = True
@@ -724,3 +1377,180 @@ class Link(models.Model):
                             default=LINK_NO_TYPE,
                             )
     url = models.URLField(null=False)
+
+
+class OutgoingEmail(models.Model):
+    """An email waiting in the outbox, sent by the send_queued_mail command
+    so that no request has to wait for the SMTP server."""
+
+    MAX_LEN_SUBJECT = 255
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(minutes=1)
+    # how long a worker has to send the emails it claimed
+    CLAIM_DELAY = timedelta(minutes=10)
+
+    QUEUED = 'Q'
+    SENT = 'S'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=MAX_LEN_SUBJECT)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.TextField() # one address per line
+    status = models.CharField(
+                    max_length=1,
+                    choices=STATUS_CHOICES,
+                    default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_date']),
+        ]
+
+    def __str__(self):
+        return "[%02d] %s <%s>" % (self.pk, self.subject, self.status)
+
+    @staticmethod
+    def queue_depth():
+        return OutgoingEmail.objects.filter(status=OutgoingEmail.QUEUED).count()
+
+    def get_recipients(self):
+        return [r for r in self.recipients.splitlines() if r]
+
+    def sent(self):
+        self.status = OutgoingEmail.SENT
+        self.sent_date = timezone.now()
+        self.attempts += 1
+        self.save()
+
+    def retry_later(self, error):
+        """Schedule a new attempt with an exponential backoff, give up
+        after MAX_ATTEMPTS."""
+
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= OutgoingEmail.MAX_ATTEMPTS:
+            self.status = OutgoingEmail.FAILED
+        else:
+            delay = OutgoingEmail.RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.next_attempt_date = timezone.now() + delay
+        self.save()
+
+
+class EmailBroadcast(models.Model):
+    """An email sent individually to every member subscribed to the new
+    workshops notifications. last_user_pk records the progress so an
+    interrupted broadcast resumes where it stopped."""
+
+    MAX_LEN_SUBJECT = 255
+    # failures of the same chunk in a row before giving up
+    MAX_ATTEMPTS = OutgoingEmail.MAX_ATTEMPTS
+    RETRY_DELAY = OutgoingEmail.RETRY_DELAY
+    CLAIM_DELAY = OutgoingEmail.CLAIM_DELAY
+
+    QUEUED = OutgoingEmail.QUEUED
+    SENT = OutgoingEmail.SENT
+    FAILED = OutgoingEmail.FAILED
+    STATUS_CHOICES = OutgoingEmail.STATUS_CHOICES
+
+    subject = models.CharField(max_length=MAX_LEN_SUBJECT)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    status = models.CharField(
+                    max_length=1,
+                    choices=STATUS_CHOICES,
+                    default=QUEUED)
+    last_user_pk = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    done_date = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_date']),
+        ]
+
+    def __str__(self):
+        return "[%02d] %s (%d sent)" % (self.pk, self.subject, self.sent_count)
+
+    @staticmethod
+    def pending():
+        # the broadcasts done before the status existed have a done_date
+        return EmailBroadcast.objects.filter(
+                                    status=EmailBroadcast.QUEUED,
+                                    done_date=None,
+                                    )
+
+    def claim(self):
+        """Keep the other workers off the broadcast while a chunk is sent,
+        until it is sent or the worker sending it died."""
+
+        self.next_attempt_date = timezone.now() + EmailBroadcast.CLAIM_DELAY
+        EmailBroadcast.objects.filter(pk=self.pk).update(
+                                    next_attempt_date=self.next_attempt_date
+                                    )
+
+    def recipient_sent(self, user_pk):
+        self.last_user_pk = user_pk
+        self.sent_count += 1
+        # the attempts count the failures in a row without progress
+        self.attempts = 0
+        EmailBroadcast.objects.filter(pk=self.pk).update(
+                                    last_user_pk=user_pk,
+                                    sent_count=F('sent_count') + 1,
+                                    attempts=0,
+                                    )
+
+    def chunk_sent(self):
+        # the next chunk is due right away
+        self.next_attempt_date = timezone.now()
+        self.save()
+
+    def done(self):
+        self.status = EmailBroadcast.SENT
+        self.done_date = timezone.now()
+        self.save()
+
+    def retry_later(self, error):
+        """Schedule a new attempt of the chunk with an exponential
+        backoff, give up after MAX_ATTEMPTS."""
+
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= EmailBroadcast.MAX_ATTEMPTS:
+            self.status = EmailBroadcast.FAILED
+        else:
+            delay = EmailBroadcast.RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.next_attempt_date = timezone.now() + delay
+        self.save()
+
+    @staticmethod
+    def get_subscribers():
+        subscribers = User.objects.filter(
+                            is_active=True,
+                            profile__preference__notify_new_workshop=True,
+                            ).exclude(email='')
+        return subscribers
+
+    def next_recipients(self, chunk_size):
+        """Get the next (pk, email) chunk, in pk order after the progress
+        cursor: the cost of a chunk doesn't depend on the progress."""
+
+        recipients = EmailBroadcast.get_subscribers().filter(
+                                    pk__gt=self.last_user_pk,
+                                    ).order_by('pk').values_list('pk', 'email')
+        return list(recipients[:chunk_size])
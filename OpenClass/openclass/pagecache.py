@@ -0,0 +1,98 @@
+"""Whole page cache of the public pages served to anonymous visitors.
+
+Each cached page depends on groups of models ('workshops', 'badges'...).
+A group has a version number stored in the shared cache and part of the
+keys of its pages: a change to a model bumps the versions of its groups,
+so only the pages showing it are computed again. Old entries are never
+read again and expire on their own."""
+
+import hashlib
+from functools import wraps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import timezone
+from constance.signals import config_updated
+
+PAGE_TIMEOUT = 60 * 60
+VERSION_KEY = 'openclass:version:%s'
+PAGE_KEY = 'openclass:page:%s:%s'
+
+# the groups every page depends on (site name and description)
+COMMON_GROUPS = ('config',)
+# model name -> groups of the pages showing it
+MODEL_GROUPS = {
+    'Workshop': ('workshops',),
+    'Tag': ('workshops',),
+    'Badge': ('badges',),
+    'BadgeAttendance': ('badges',),
+    'FAQ': ('faq',),
+}
+
+def get_versions(groups):
+    keys = [VERSION_KEY % group for group in groups]
+    versions = cache.get_many(keys)
+    return [versions.get(key, 0) for key in keys]
+
+def invalidate(*groups):
+    """Bump the versions of groups once the current transaction commits,
+    a page computed before that would otherwise be cached again."""
+
+    def bump():
+        for group in groups:
+            key = VERSION_KEY % group
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # evicted in between, the next version is a new one anyway
+                cache.set(key, 1, timeout=None)
+    transaction.on_commit(bump)
+
+def page_key(request, groups):
+    # days_left and the like change with the date
+    versions = get_versions(groups) + [timezone.now().date().isoformat()]
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return PAGE_KEY % (path, '.'.join(str(v) for v in versions))
+
+def cache_anonymous_page(*groups):
+    """Cache the page for the anonymous visitors until a model of groups
+    changes. The authenticated users always get a fresh page."""
+
+    groups = COMMON_GROUPS + groups
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') \
+                    or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            key = page_key(request, groups)
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                # don't share a page carrying a cookie or a csrf token
+                if response.status_code == 200 and not response.cookies \
+                        and not request.META.get('CSRF_COOKIE_USED'):
+                    cache.set(key, response, PAGE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+def model_changed(sender, **kwargs):
+    invalidate(*MODEL_GROUPS[sender.__name__])
+
+def topics_changed(sender, **kwargs):
+    invalidate('workshops')
+
+def config_changed(sender, **kwargs):
+    invalidate(*COMMON_GROUPS)
+
+def connect_signals(app_config):
+    for model_name in MODEL_GROUPS:
+        model = app_config.get_model(model_name)
+        post_save.connect(model_changed, sender=model)
+        post_delete.connect(model_changed, sender=model)
+    workshop = app_config.get_model('Workshop')
+    m2m_changed.connect(topics_changed, sender=workshop.topics.through)
+    config_updated.connect(config_changed)
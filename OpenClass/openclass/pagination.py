@@ -0,0 +1,70 @@
+"""Keyset (cursor) pagination.
+
+A page is the rows strictly after the last row of the previous page in
+the queryset ordering, so it costs the same at any depth, unlike OFFSET
+which reads and drops every skipped row. The ordering must be total:
+the last key has to be unique (usually the pk)."""
+
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = 20
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+def after(keys, values):
+    """Build the filter of the rows after values in the keys ordering:
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+    A '-' prefixed key is in descending order."""
+
+    names = [key.lstrip('-') for key in keys]
+    lookups = ['__lt' if key.startswith('-') else '__gt' for key in keys]
+    filters = Q()
+    for i in range(len(keys)):
+        condition = Q(**{names[j]: values[j] for j in range(i)})
+        condition &= Q(**{names[i] + lookups[i]: values[i]})
+        filters |= condition
+    # redundant bound on the first key so the database can start an index
+    # range scan right at the cursor
+    bound = lookups[0] + 'e'
+    return Q(**{names[0] + bound: values[0]}) & filters
+
+def paginate(queryset, keys, cursor=None, page_size=None):
+    """Get the page of queryset ordered by keys that follows cursor, and
+    the cursor of the next page (None on the last page).
+    Raise InvalidCursor if the cursor can't be decoded."""
+
+    page_size = page_size or PAGE_SIZE
+    queryset = queryset.order_by(*keys)
+    if cursor:
+        values = decode_cursor(cursor, len(keys))
+        try:
+            queryset = queryset.filter(after(keys, values))
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+                        [getattr(last, key.lstrip('-')) for key in keys]
+                        )
+    return items, next_cursor
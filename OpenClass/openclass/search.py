@@ -0,0 +1,115 @@
+"""Workshops search: weighted full text search on PostgreSQL, plus typo
+tolerant title matching when the pg_trgm extension is available. Other
+databases fall back to a plain icontains on the title.
+
+Members search: case insensitive prefix match of the username and the
+names, served by expression indexes on PostgreSQL."""
+
+import logging
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q, F, Value, FloatField
+from django.db.models.functions import Cast
+from django.contrib.postgres.search import (
+    SearchVector, SearchQuery, SearchRank, TrigramSimilarity,
+)
+
+logger = logging.getLogger(__name__)
+
+# weighted document stored in Workshop.search_vector
+WORKSHOP_SEARCH_VECTOR = SearchVector('title', weight='A') + \
+                         SearchVector('description', weight='B') + \
+                         SearchVector('objectives', weight='C')
+
+TRIGRAM_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS openclass_workshop_title_trgm
+    ON openclass_workshop USING gin (title gin_trgm_ops)
+"""
+
+# istartswith is UPPER(column) LIKE UPPER('text%'), the pattern operator
+# class lets the btree index serve the LIKE whatever the collation
+MEMBER_PREFIX_INDEXES_SQL = [
+    """
+    CREATE INDEX IF NOT EXISTS openclass_user_%(field)s_prefix
+    ON auth_user (UPPER(%(field)s) text_pattern_ops)
+    """ % {'field': field}
+    for field in ('username', 'first_name', 'last_name')
+]
+
+_has_trigram = None
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+def has_trigram():
+    """Check once per process that the pg_trgm extension is installed."""
+
+    global _has_trigram
+    if _has_trigram is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                )
+            _has_trigram = cursor.fetchone() is not None
+    return _has_trigram
+
+def update_search_vector(workshops):
+    """Recompute the search document of a Workshop queryset."""
+
+    if is_postgresql():
+        return workshops.update(search_vector=WORKSHOP_SEARCH_VECTOR)
+    return 0
+
+def search_filter(text):
+    """Match the full text document, or the title with typos."""
+
+    if not is_postgresql():
+        return Q(title__icontains=text)
+    filters = Q(search_vector=SearchQuery(text))
+    if has_trigram():
+        filters |= Q(title__trigram_similar=text)
+    return filters
+
+def search_rank(text):
+    if not is_postgresql():
+        return Value(0, output_field=FloatField())
+    rank = SearchRank(F('search_vector'), SearchQuery(text))
+    if has_trigram():
+        rank = rank + TrigramSimilarity('title', text)
+    # double precision round trips through python floats, so the rank can be
+    # compared with the one of a pagination cursor
+    return Cast(rank, FloatField())
+
+def member_filter(text):
+    """Match the members whose username, first or last name starts with
+    every word of text."""
+
+    filters = Q()
+    for word in text.split():
+        filters &= Q(username__istartswith=word) | \
+                   Q(first_name__istartswith=word) | \
+                   Q(last_name__istartswith=word)
+    return filters
+
+def install_search_indexes(sender, **kwargs):
+    """post_migrate: the trigram index can't be declared in Meta.indexes,
+    it needs the pg_trgm extension and a custom operator class, and the
+    members prefix indexes are on expressions of the auth_user table.
+    Also fill the search document of the workshops that have none."""
+
+    global _has_trigram
+    if not is_postgresql():
+        return
+
+    from .models import Workshop
+
+    with connection.cursor() as cursor:
+        for sql in MEMBER_PREFIX_INDEXES_SQL:
+            cursor.execute(sql)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(TRIGRAM_INDEX_SQL)
+    except DatabaseError:
+        logger.warning("pg_trgm is not available, no typo tolerant search")
+    _has_trigram = None
+    update_search_vector(Workshop.objects.filter(search_vector=None))
@@ -1,12 +0,0 @@
-if (jQuery("#scoreboard_list").DataTable() != null) {
-	var table = jQuery("#scoreboard_list").DataTable();
-	console.log(table);
-	// var page = table.page();
-	// var lenpage = table.page.len();
-	// var tabledata = table.data();
-	// var info = table.page.info();
-	// console.log(lenpage);
-	// console.log(page);
-	// console.log(tabledata);
-	// console.log(info);
-}
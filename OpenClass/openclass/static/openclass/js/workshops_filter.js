@@ -46,3 +46,19 @@ function search_title() {
     input_value=input.value.toLowerCase();
     ajax()
 }
+
+// infinite scroll: load the next page when the end of the list is visible
+var loading = false;
+
+function load_more() {
+    var next = $(".workshops-next");
+    if (loading || next.length === 0) {
+        return;
+    }
+    if (next.offset().top < $(window).scrollTop() + $(window).height() + 200) {
+        loading = true;
+        ajax(next.data("cursor"));
+    }
+}
+
+$(window).on("scroll", load_more);
@@ -0,0 +1,27 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from openclass.thumbnails import Thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(thumbnail, **attributes):
+    """Render a thumbnails.Thumbnail as an <img>, wrapped in a <picture>
+    offering the WebP version when there is one. The keyword arguments
+    are the attributes of the <img>:
+
+        {% picture workshop.cover_thumbnails.card class="img-background" %}
+    """
+
+    if not isinstance(thumbnail, Thumbnail):
+        return ''
+    img = format_html('<img src="{}"{}>',
+                      thumbnail.url,
+                      format_html_join('', ' {}="{}"', attributes.items()))
+    if thumbnail.webp_url is None:
+        return img
+    return format_html('<picture><source srcset="{}" type="image/webp">'
+                       '{}</picture>',
+                       thumbnail.webp_url,
+                       img)
@@ -0,0 +1,36 @@
+from django.test import TestCase
+from unittest import mock
+from openclass import constance_backend
+from openclass.constance_backend import CachedRedisBackend
+
+
+class CachedRedisBackendTest(TestCase):
+    """constance values read from the per-process copy"""
+
+    def setUp(self):
+        self.backend = CachedRedisBackend()
+        self.other = CachedRedisBackend()
+        site_name = self.backend.get('SITE_NAME')
+        if site_name is not None:
+            self.addCleanup(self.other.set, 'SITE_NAME', site_name)
+        else:
+            key = self.other.add_prefix('SITE_NAME')
+            self.addCleanup(self.other._rd.delete, key)
+
+    def test_one_round_trip(self):
+        self.backend.get('SITE_NAME')
+        with mock.patch.object(self.backend, '_rd') as rd:
+            for i in range(10):
+                self.backend.get('SITE_NAME')
+                self.backend.get('SITE_DESCRIPTION')
+        self.assertFalse(rd.method_calls)
+
+    def test_invalidation(self):
+        self.backend.set('SITE_NAME', 'OpenClass')
+        self.assertEqual(self.backend.get('SITE_NAME'), 'OpenClass')
+        self.other.set('SITE_NAME', 'ClosedClass')
+        # the local copy is kept until it expires
+        self.assertEqual(self.backend.get('SITE_NAME'), 'OpenClass')
+        with mock.patch.object(constance_backend, 'LOCAL_TIMEOUT', 0):
+            self.backend._expires = 0
+            self.assertEqual(self.backend.get('SITE_NAME'), 'ClosedClass')
@@ -0,0 +1,254 @@
+from django.test import TestCase, override_settings
+from django.db import OperationalError
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+from django.utils import timezone
+from openclass.models import *
+from openclass import email
+
+
+class FailingConnection:
+    """Stand-in for an SMTP connection whose server rejects everything"""
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def send_messages(self, messages):
+        raise ConnectionRefusedError("smtp server is down")
+
+
+class StopLoop(BaseException):
+    """Raised by the patched sleep to leave the worker loop"""
+
+
+@override_settings(EMAIL_ENABLED=True)
+class OutboxTest(TestCase):
+    """Emails are queued by the models and sent by the worker"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+                                username='youben11',
+                                email='youben@yopmail.com',
+                                )
+        cls.profile = Profile.objects.create(
+                        phone_number='+21666',
+                        birthday=date.today(),
+                        user=cls.user,
+                        )
+        Preference.objects.create(profile=cls.profile)
+        cls.workshop = Workshop.objects.create(
+                        title='tommorow',
+                        description="exploit dev",
+                        required_materials="laptop, linux OS",
+                        objectives="debuggin, exploit dev",
+                        requirements="C programming, Linux basics",
+                        seats_number=10,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(1),
+                        duration=timedelta(minutes=90),
+                        location='amphi c',
+                        animator=cls.profile,
+                        )
+
+    def setUp(self):
+        # accept() changes the instance, don't share it between tests
+        self.workshop = Workshop.objects.get(pk=self.workshop.pk)
+
+    def test_accept_does_not_send(self):
+        self.workshop.accept(self.profile)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.queue_depth(), 1)
+        self.assertEqual(EmailBroadcast.objects.count(), 1)
+
+    def test_register_queues_acceptance(self):
+        self.workshop.register(self.profile)
+        outgoing_email = OutgoingEmail.objects.get()
+        self.assertEqual(outgoing_email.get_recipients(), [self.user.email])
+
+    def test_send_queued_mail(self):
+        self.workshop.refuse(self.profile)
+        email.queue_mail("subject", "body", None, [self.user.email])
+        sent, failed = email.send_queued_mail()
+        self.assertEqual((sent, failed), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(OutgoingEmail.queue_depth(), 0)
+        self.assertEqual(
+            OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 2)
+
+    def test_retry_with_backoff(self):
+        email.queue_mail("subject", "body", None, [self.user.email])
+        sent, failed = email.send_queued_mail(connection=FailingConnection())
+        self.assertEqual((sent, failed), (0, 1))
+        outgoing_email = OutgoingEmail.objects.get()
+        self.assertEqual(outgoing_email.status, OutgoingEmail.QUEUED)
+        self.assertEqual(outgoing_email.attempts, 1)
+        self.assertGreater(outgoing_email.next_attempt_date, timezone.now())
+        # not due yet
+        self.assertEqual(email.send_queued_mail(), (0, 0))
+
+        OutgoingEmail.objects.update(
+                    attempts=OutgoingEmail.MAX_ATTEMPTS - 1,
+                    next_attempt_date=timezone.now(),
+                    )
+        email.send_queued_mail(connection=FailingConnection())
+        outgoing_email.refresh_from_db()
+        self.assertEqual(outgoing_email.status, OutgoingEmail.FAILED)
+
+    def test_claimed_before_sending(self):
+        email.queue_mail("subject", "body", None, [self.user.email])
+        claimed = []
+
+        class ClaimCheckingConnection(FailingConnection):
+            def send_messages(self, messages):
+                # no other worker can pick the email while it is sent
+                claimed.append(not OutgoingEmail.objects.filter(
+                            next_attempt_date__lte=timezone.now()).exists())
+                return len(messages)
+
+        sent, failed = email.send_queued_mail(
+                                connection=ClaimCheckingConnection())
+        self.assertEqual((sent, failed), (1, 0))
+        self.assertEqual(claimed, [True])
+
+    def test_loop_survives_errors(self):
+        outage = [OperationalError("server closed the connection"), (0, 0)]
+        with mock.patch.object(email, 'send_queued_mail',
+                               side_effect=outage) as send_queued_mail, \
+                mock.patch('time.sleep', side_effect=[None, StopLoop]), \
+                mock.patch('openclass.management.commands.send_queued_mail.'
+                           'close_old_connections') as close_old_connections, \
+                self.assertLogs('openclass', 'ERROR'):
+            with self.assertRaises(StopLoop):
+                call_command('send_queued_mail', '--loop', stdout=StringIO())
+        self.assertEqual(send_queued_mail.call_count, 2)
+        self.assertEqual(close_old_connections.call_count, 1)
+
+    def test_command(self):
+        self.workshop.accept(self.profile)
+        out = StringIO()
+        call_command('send_queued_mail', stdout=out)
+        self.assertEqual(len(mail.outbox), 2)
+        call_command('send_queued_mail', '--stats', stdout=out)
+        self.assertIn("queued: 0", out.getvalue())
+
+
+@override_settings(EMAIL_ENABLED=True)
+class BroadcastTest(TestCase):
+    """The new workshop notification is sent to each subscriber separately"""
+
+    SUBSCRIBERS_NUMBER = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(cls.SUBSCRIBERS_NUMBER + 1):
+            user = User.objects.create(
+                                username='member%d' % i,
+                                email='member%d@yopmail.com' % i,
+                                )
+            profile = Profile.objects.create(user=user, phone_number='0555')
+            Preference.objects.create(profile=profile)
+        # the last one is not interested
+        Preference.objects.filter(profile=profile).update(
+                                            notify_new_workshop=False)
+        cls.workshop = Workshop.objects.create(
+                        title='tommorow',
+                        description="exploit dev",
+                        required_materials="laptop, linux OS",
+                        objectives="debuggin, exploit dev",
+                        requirements="C programming, Linux basics",
+                        seats_number=10,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(1),
+                        duration=timedelta(minutes=90),
+                        location='amphi c',
+                        )
+
+    def test_one_message_per_recipient(self):
+        email.notify_new_workshop(self.workshop)
+        sent = email.send_broadcasts(chunk_size=3)
+        self.assertEqual(sent, self.SUBSCRIBERS_NUMBER)
+        self.assertEqual(len(mail.outbox), self.SUBSCRIBERS_NUMBER)
+        for message in mail.outbox:
+            self.assertEqual(len(message.to), 1)
+        broadcast = EmailBroadcast.objects.get()
+        self.assertIsNotNone(broadcast.done_date)
+        self.assertEqual(broadcast.sent_count, self.SUBSCRIBERS_NUMBER)
+
+    def test_resume(self):
+        email.notify_new_workshop(self.workshop)
+        broadcast = EmailBroadcast.objects.get()
+        email.send_broadcast_chunk(broadcast.pk, chunk_size=3)
+        self.assertEqual(len(mail.outbox), 3)
+
+        # the worker crashes in the middle of the next chunk
+        with self.assertRaises(ConnectionRefusedError):
+            email.send_broadcast_chunk(broadcast.pk, 3, FailingConnection())
+        broadcast.refresh_from_db()
+        self.assertEqual(broadcast.sent_count, 3)
+        self.assertEqual(broadcast.attempts, 1)
+        self.assertGreater(broadcast.next_attempt_date, timezone.now())
+        # not due yet
+        self.assertEqual(email.send_broadcasts(chunk_size=3), 0)
+
+        EmailBroadcast.objects.update(next_attempt_date=timezone.now())
+        email.send_broadcasts(chunk_size=3)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), self.SUBSCRIBERS_NUMBER)
+        self.assertEqual(len(set(recipients)), self.SUBSCRIBERS_NUMBER)
+        broadcast.refresh_from_db()
+        self.assertEqual(broadcast.status, EmailBroadcast.SENT)
+        self.assertEqual(broadcast.attempts, 0)
+
+    def test_failure_within_chunk(self):
+        email.notify_new_workshop(self.workshop)
+        broadcast = EmailBroadcast.objects.get()
+        claimed = []
+
+        class FlakyConnection(FailingConnection):
+            def send_messages(self, messages):
+                # no lock held and no other worker can pick the chunk
+                claimed.append(not EmailBroadcast.pending().filter(
+                            next_attempt_date__lte=timezone.now()).exists())
+                if len(claimed) > 2:
+                    super().send_messages(messages)
+                mail.outbox.extend(messages)
+                return len(messages)
+
+        with self.assertRaises(ConnectionRefusedError):
+            email.send_broadcast_chunk(broadcast.pk, 5, FlakyConnection())
+        self.assertEqual(claimed, [True] * 3)
+        broadcast.refresh_from_db()
+        self.assertEqual(broadcast.sent_count, 2)
+        self.assertEqual(broadcast.attempts, 1)
+
+        # the two members already notified don't get it again
+        EmailBroadcast.objects.update(next_attempt_date=timezone.now())
+        email.send_broadcasts(chunk_size=5)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), self.SUBSCRIBERS_NUMBER)
+        self.assertEqual(len(set(recipients)), self.SUBSCRIBERS_NUMBER)
+
+    def test_give_up(self):
+        email.notify_new_workshop(self.workshop)
+        for i in range(EmailBroadcast.MAX_ATTEMPTS):
+            EmailBroadcast.objects.update(next_attempt_date=timezone.now())
+            email.send_broadcasts(3, FailingConnection())
+        broadcast = EmailBroadcast.objects.get()
+        self.assertEqual(broadcast.status, EmailBroadcast.FAILED)
+        self.assertEqual(broadcast.attempts, EmailBroadcast.MAX_ATTEMPTS)
+        self.assertIn("smtp server is down", broadcast.last_error)
+        self.assertFalse(EmailBroadcast.pending().exists())
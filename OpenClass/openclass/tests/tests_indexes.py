@@ -0,0 +1,90 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import connection
+from datetime import timedelta
+from unittest import skipUnless
+from django.utils import timezone
+from openclass.models import *
+
+# large enough for a sequential scan to cost more than an index scan
+NB_MEMBERS = 200
+NB_WORKSHOPS = 400
+NB_REGISTRATIONS = 20 # per member
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs EXPLAIN on PostgreSQL")
+class QueryPlanTest(TestCase):
+    """The hot filters on Registration and Workshop must be served by an
+    index on a seeded database: no sequential scan, and no condition left
+    to filter the rows read through the index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        statuses = (Workshop.ACCEPTED, Workshop.DONE, Workshop.DONE,
+                    Workshop.DONE, Workshop.PENDING, Workshop.REFUSED)
+        Workshop.objects.bulk_create(
+                    Workshop(title='workshop %d' % i,
+                             description='description',
+                             seats_number=50,
+                             submission_date=now,
+                             start_date=now + timedelta(days=i - 300),
+                             duration=timedelta(hours=2),
+                             location='amphi c',
+                             status=statuses[i % len(statuses)])
+                    for i in range(NB_WORKSHOPS)
+                    )
+        users = User.objects.bulk_create(
+                    User(username='member%d' % i) for i in range(NB_MEMBERS)
+                    )
+        profiles = Profile.objects.bulk_create(
+                    Profile(user=user, phone_number='0555') for user in users
+                    )
+        workshops = list(Workshop.objects.order_by('pk'))
+        registration_statuses = (Registration.ACCEPTED, Registration.ACCEPTED,
+                                 Registration.ACCEPTED, Registration.WAITLISTED,
+                                 Registration.CANCELED)
+        Registration.objects.bulk_create(
+                    Registration(workshop=workshops[(i * 7 + j) % NB_WORKSHOPS],
+                                 profile=profile,
+                                 date_registration=now,
+                                 status=registration_statuses[j % 5],
+                                 present=(j % 2 == 0))
+                    for i, profile in enumerate(profiles)
+                    for j in range(NB_REGISTRATIONS)
+                    )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE openclass_workshop")
+            cursor.execute("ANALYZE openclass_registration")
+        cls.workshop = workshops[NB_WORKSHOPS // 2]
+        cls.profile = profiles[0]
+
+    def assertIndexScan(self, queryset, table):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan on %s' % table, plan, plan)
+        self.assertIn('Index', plan, plan)
+        self.assertNotIn('Filter:', plan, plan)
+
+    def test_registrations_of_a_workshop(self):
+        registrations = Registration.objects.filter(workshop=self.workshop)
+        for queryset in (
+                registrations.filter(status=Registration.ACCEPTED),
+                registrations.filter(present=True),
+                self.workshop.waitlist()[:1],
+                ):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexScan(queryset, 'openclass_registration')
+
+    def test_registrations_of_a_member(self):
+        queryset = Registration.objects.filter(
+                            profile=self.profile,
+                            status=Registration.ACCEPTED,
+                            )
+        self.assertIndexScan(queryset, 'openclass_registration')
+
+    def test_upcoming_workshops(self):
+        queryset = Workshop.objects.filter(
+                            status=Workshop.ACCEPTED,
+                            start_date__gte=timezone.now(),
+                            ).order_by('start_date', 'pk')[:21]
+        self.assertIndexScan(queryset, 'openclass_workshop')
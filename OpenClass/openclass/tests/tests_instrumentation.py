@@ -0,0 +1,63 @@
+import json
+from django.test import TestCase
+from django.core.cache import cache
+from django.urls import reverse
+from openclass.models import *
+from openclass import metrics
+
+
+class InstrumentationTest(TestCase):
+    """Per-request stats logged and aggregated by the middleware"""
+
+    @classmethod
+    def setUpTestData(cls):
+        FAQ.objects.create(question="Who?", answer="Us.")
+
+    def setUp(self):
+        cache.clear()
+
+    def get_line(self, logs, level='INFO'):
+        for record in logs.records:
+            if record.levelname == level:
+                return json.loads(record.getMessage())
+
+    def test_log_line(self):
+        with self.assertLogs('openclass.requests', 'INFO') as logs:
+            self.client.get(reverse('openclass:faq'))
+        line = self.get_line(logs)
+        self.assertEqual(line['view'], 'openclass:faq')
+        self.assertEqual(line['status'], 200)
+        self.assertEqual(line['queries'], 1)
+        self.assertGreaterEqual(line['cache_misses'], 1)
+        self.assertIsNone(self.get_line(logs, 'WARNING'))
+
+        with self.assertLogs('openclass.requests', 'INFO') as logs:
+            self.client.get(reverse('openclass:faq'))
+        line = self.get_line(logs)
+        self.assertEqual(line['queries'], 0)
+        self.assertGreaterEqual(line['cache_hits'], 1)
+
+    def test_redacted_path(self):
+        with self.assertLogs('openclass.requests', 'INFO') as logs:
+            self.client.get(reverse('openclass:verify', args=('s3cr3t',)))
+        line = self.get_line(logs)
+        self.assertEqual(line['view'], 'openclass:verify')
+        self.assertEqual(line['path'], '/verify/<token>/')
+
+    def test_slow_request(self):
+        with self.settings(SLOW_REQUEST_THRESHOLD=0):
+            with self.assertLogs('openclass.requests', 'INFO') as logs:
+                self.client.get(reverse('openclass:faq'))
+        line = self.get_line(logs, 'WARNING')
+        self.assertIn('openclass_faq', line['sql'][0]['sql'])
+
+    def test_histograms(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        with self.assertLogs('openclass.requests', 'INFO'):
+            self.client.get(reverse('openclass:faq'))
+        samples = metrics.render().splitlines()
+        self.assertIn('openclass_request_queries_count{view="openclass:faq"} 1',
+                      samples)
+        self.assertIn('openclass_request_queries_bucket'
+                      '{le="1",view="openclass:faq"} 1', samples)
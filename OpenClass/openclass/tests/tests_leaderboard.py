@@ -0,0 +1,98 @@
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from unittest import mock
+from constance import config
+from openclass.models import *
+from openclass import leaderboard
+
+TEST_KEY = 'openclass:test:leaderboard'
+
+
+def create_profile(username, score=0):
+    user = User.objects.create(username=username)
+    return Profile.objects.create(user=user, phone_number='0555', score=score)
+
+
+class TestKeyMixin:
+    """Don't touch the real leaderboard"""
+
+    def setUp(self):
+        patcher = mock.patch.object(leaderboard, 'LEADERBOARD_KEY', TEST_KEY)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(leaderboard.get_connection().delete, TEST_KEY,
+                        TEST_KEY + ':built', TEST_KEY + ':lock')
+
+
+class LeaderboardTest(TestKeyMixin, TestCase):
+    """Ranking read from the redis sorted set"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profiles = [
+            create_profile('member%d' % i, score=10 * i) for i in range(30)
+            ]
+
+    def setUp(self):
+        super().setUp()
+        leaderboard.rebuild()
+
+    def test_top(self):
+        ranking = leaderboard.top(0, 3)
+        self.assertEqual(ranking, [
+                        (self.profiles[29].pk, 290),
+                        (self.profiles[28].pk, 280),
+                        (self.profiles[27].pk, 270),
+                        ])
+        ranking = leaderboard.top(28, 5)
+        self.assertEqual([pk for pk, score in ranking],
+                        [self.profiles[1].pk, self.profiles[0].pk])
+
+    def test_rank(self):
+        self.assertEqual(leaderboard.rank(self.profiles[29]), 1)
+        self.assertEqual(leaderboard.rank(self.profiles[0]), 30)
+        self.assertEqual(leaderboard.size(), 30)
+
+    def test_rebuilt_when_lost(self):
+        # redis restarted without its data, then a member gained points
+        leaderboard.get_connection().delete(TEST_KEY, TEST_KEY + ':built')
+        leaderboard.add_points(self.profiles[0].pk, 5)
+        self.assertEqual(leaderboard.top(0, 1), [(self.profiles[29].pk, 290)])
+        self.assertEqual(leaderboard.size(), 30)
+
+    def test_rank_when_lost(self):
+        leaderboard.get_connection().delete(TEST_KEY, TEST_KEY + ':built')
+        self.assertEqual(leaderboard.rank(self.profiles[29]), 1)
+
+    def test_scoreboard_view(self):
+        self.client.force_login(self.profiles[0].user)
+        response = self.client.get(reverse('openclass:leaderboard'))
+        self.assertEqual(len(response.context['ranking']), 25)
+        self.assertEqual(response.context['my_rank'], 30)
+        self.assertTrue(response.context['has_next'])
+
+        response = self.client.get(reverse('openclass:leaderboard'), {'page': 2})
+        ranks = [rank for rank, profile, score in response.context['ranking']]
+        self.assertEqual(ranks, list(range(26, 31)))
+        self.assertFalse(response.context['has_next'])
+
+
+class LeaderboardSyncTest(TestKeyMixin, TransactionTestCase):
+    """The sorted set follows the points gained once committed"""
+
+    def test_gain_points(self):
+        profile = create_profile('youben11')
+        self.assertEqual(leaderboard.top(0, 1), [(profile.pk, 0)])
+        profile.gain_attendance_points()
+        profile.gain_animation_points()
+        points = config.POINTS_ATTENDANCE + config.POINTS_ANIMATION
+        self.assertEqual(leaderboard.top(0, 1), [(profile.pk, points)])
+
+    def test_deleted_member(self):
+        leaderboard.rebuild()
+        profile = create_profile('youben11', score=10)
+        other = create_profile('youben12')
+        profile.user.delete()
+        self.assertEqual(leaderboard.top(0, 2), [(other.pk, 0)])
+        self.assertEqual(leaderboard.size(), 1)
@@ -0,0 +1,76 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from datetime import timedelta
+from django.utils import timezone
+from openclass.models import *
+from openclass import metrics
+
+
+class MetricsTest(TestCase):
+    """Metrics shared by the workers, in the Prometheus text format"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = Workshop.objects.create(
+                        title='metrics',
+                        description="prometheus",
+                        required_materials="laptop",
+                        objectives="scraping",
+                        requirements="none",
+                        seats_number=1,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(days=1),
+                        duration=timedelta(hours=2),
+                        location='amphi c',
+                        status=Workshop.ACCEPTED)
+        cls.profiles = []
+        for i in range(2):
+            user = User.objects.create(username='member%d' % i)
+            cls.profiles.append(
+                    Profile.objects.create(user=user, phone_number='0555')
+                    )
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def get_samples(self):
+        response = self.client.get(reverse('openclass:metrics'))
+        self.assertEqual(response.status_code, 200)
+        return dict(
+                line.rsplit(' ', 1)
+                for line in response.content.decode().splitlines()
+                if not line.startswith('#')
+                )
+
+    def test_registrations(self):
+        for profile in self.profiles:
+            self.workshop.register(profile)
+        samples = self.get_samples()
+        accepted = 'openclass_registrations_total{outcome="accepted"}'
+        waitlisted = 'openclass_registrations_total{outcome="waitlisted"}'
+        self.assertEqual(samples[accepted], '1')
+        self.assertEqual(samples[waitlisted], '1')
+        self.assertEqual(samples['openclass_outbox_depth'], '0')
+
+    def test_requests(self):
+        with self.assertLogs('openclass.requests', 'INFO'):
+            self.client.get(reverse('openclass:about'))
+        samples = self.get_samples()
+        requests = 'openclass_requests_total{method="GET",status="200",' \
+                   'view="openclass:about"}'
+        self.assertEqual(samples[requests], '1')
+        count = 'openclass_request_queries_count{view="openclass:about"}'
+        self.assertEqual(samples[count], '1')
+        inf = 'openclass_request_queries_bucket{le="+Inf",' \
+              'view="openclass:about"}'
+        self.assertEqual(samples[inf], '1')
+
+    def test_aggregation(self):
+        # what two workers would flush
+        metrics.inc_counter('openclass_cache_hits_total', amount=2)
+        metrics.flush(force=True)
+        metrics.inc_counter('openclass_cache_hits_total', amount=3)
+        metrics.flush(force=True)
+        self.assertIn('openclass_cache_hits_total 5\n', metrics.render())
@@ -1,6 +1,15 @@
-from django.test import TestCase
+import json
+from io import StringIO
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
+from django.db import connection
+from django.core.cache import cache
+from django.core import signing
+from django.core.management import call_command
+from django.urls import reverse
 from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 from django.utils import timezone
 from openclass.models import *
 
@@ -94,6 +103,20 @@ class ProfileTest(TestCase):
         workshop = self.profile.workshops_attended()[0]
         self.assertEqual(workshop.title, 'Binary Analysis')
 
+    def test_with_page_data(self):
+        attended = list(self.profile.workshops_attended())
+        animated = list(self.profile.workshops_animated())
+        with self.assertNumQueries(6):
+            profile = Profile.objects.with_page_data().get(pk=self.profile.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                    [r.workshop for r in profile.attended_registrations],
+                    attended,
+                    )
+            self.assertEqual(profile.animated_workshops, animated)
+            self.assertEqual(profile.user.profile, profile)
+            self.assertEqual(len(profile.interests.all()), 2)
+
     def test_get_interest(self):
         interest = self.profile.get_interests()
         self.assertEqual(interest.get(id=self.tag1.id).name, self.tag1.name)
@@ -123,6 +146,41 @@ class ProfileTest(TestCase):
         self.profile.update_last_name('')
         self.assertEqual(self.profile.user.last_name, 'benaissa')
 
+    def test_gain_points(self):
+        stale = Profile.objects.get(pk=self.profile.pk)
+        self.profile.gain_points(10)
+        stale.gain_points(5)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.score, 115)
+
+    def test_gain_points_many(self):
+        user = User.objects.create(username='youben12')
+        profile = Profile.objects.create(user=user, score=0, phone_number='0')
+        count = Profile.gain_points_many([self.profile.pk, profile.pk], 10)
+        self.assertEqual(count, 2)
+        self.profile.refresh_from_db()
+        profile.refresh_from_db()
+        self.assertEqual(self.profile.score, 110)
+        self.assertEqual(profile.score, 10)
+
+    def test_verification_tokens(self):
+        with self.assertNumQueries(2):
+            token = self.profile.generate_verification_token()
+        self.assertEqual(len(token), VerificationToken.TOKEN_LEN)
+        user = User.objects.create(username='youben12')
+        profile = Profile.objects.create(user=user, phone_number='0')
+        with self.assertNumQueries(2):
+            tokens = VerificationToken.generate_many([self.profile, profile])
+        self.assertNotEqual(tokens[self.profile.pk], token)
+        self.assertNotEqual(tokens[self.profile.pk], tokens[profile.pk])
+        self.assertFalse(VerificationToken.objects.filter(value=token).exists())
+
+        response = self.client.get(reverse('openclass:verify',
+                                           args=(tokens[profile.pk],)))
+        self.assertRedirects(response, reverse('openclass:profile'),
+                             fetch_redirect_response=False)
+        self.assertEqual(VerificationToken.objects.count(), 1)
+
     def test_ask(self):
         self.profile.ask(self.workshop.id, "What does RE mean ?")
         question = self.profile.asked.all()[0]
@@ -205,7 +263,7 @@ class WorkshopTest(TestCase):
                                 profile=user.profile
                                 )
         self.assertEqual(registration.status, Registration.ACCEPTED)
-        #second registration should
+        #second registration should be waitlisted
         user = User.objects.get(username='youben12')
         r = workshop.register(user.profile)
         self.assertEqual(r, True)
@@ -213,7 +271,18 @@ class WorkshopTest(TestCase):
                                 workshop=workshop,
                                 profile=user.profile
                                 )
-        self.assertEqual(registration.status, Registration.PENDING)
+        self.assertEqual(registration.status, Registration.WAITLISTED)
+        self.assertEqual(registration.waitlist_position(), 1)
+        #register a third one
+        user = User.objects.get(username='youben13')
+        r = workshop.register(user.profile)
+        self.assertEqual(r, True)
+        registration = Registration.objects.get(
+                                workshop=workshop,
+                                profile=user.profile
+                                )
+        self.assertEqual(registration.status, Registration.WAITLISTED)
+        self.assertEqual(registration.waitlist_position(), 2)
         #cancel registration for the first user
         user = User.objects.get(username='youben11')
         r = workshop.cancel_registration(user.profile)
@@ -223,15 +292,211 @@ class WorkshopTest(TestCase):
                                 profile=user.profile
                                 )
         self.assertEqual(registration.status, Registration.CANCELED)
-        #register a third one
-        user = User.objects.get(username='youben13')
-        r = workshop.register(user.profile)
-        self.assertEqual(r, True)
+        #the head of the waitlist takes the freed seat
         registration = Registration.objects.get(
                                 workshop=workshop,
-                                profile=user.profile
+                                profile=self.profile2
                                 )
         self.assertEqual(registration.status, Registration.ACCEPTED)
+        registration = Registration.objects.get(
+                                workshop=workshop,
+                                profile=self.profile3
+                                )
+        self.assertEqual(registration.waitlist_position(), 1)
+        workshop.refresh_from_db()
+        self.assertEqual(workshop.accepted_count, 1)
+        self.assertEqual(workshop.seats_left(), 0)
+
+    def test_registration_state(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        state = self.profile2.registration_state(workshop)
+        self.assertFalse(state.is_registered)
+        workshop.register(self.profile)
+        workshop.register(self.profile2)
+        # looked up once, then kept on the profile
+        with self.assertNumQueries(2):
+            state = self.profile2.registration_state(workshop)
+            self.assertIs(self.profile2.registration_state(workshop), state)
+            self.assertTrue(self.profile2.is_registered(workshop))
+            self.assertTrue(self.profile2.can_cancel_registration(workshop))
+        self.assertTrue(state.is_waitlisted)
+        self.assertEqual(state.waitlist_position, 1)
+        with self.assertRaises(AttributeError):
+            state.status = Registration.ACCEPTED
+        workshop.cancel_registration(self.profile2)
+        state = self.profile2.registration_state(workshop)
+        self.assertTrue(state.is_canceled)
+        self.assertFalse(state.is_cancelable)
+
+    def test_update_seats_number_promotes_waitlist(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        for profile in (self.profile, self.profile2, self.profile3):
+            workshop.register(profile)
+        self.assertEqual(workshop.waitlist().count(), 2)
+
+        ret = workshop.update_seats_number(2)
+        self.assertEqual(ret, True)
+        self.assertEqual(workshop.accepted_count, 2)
+        head = workshop.waitlist().get()
+        self.assertEqual(head.profile, self.profile3)
+
+        workshop.update_seats_number(10)
+        self.assertEqual(workshop.waitlist().count(), 0)
+        workshop.refresh_from_db()
+        self.assertEqual(workshop.accepted_count, 3)
+
+    def test_cancel_waitlisted_keeps_seat(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        workshop.register(self.profile)
+        workshop.register(self.profile2)
+        workshop.cancel_registration(self.profile2)
+        workshop.refresh_from_db()
+        self.assertEqual(workshop.accepted_count, 1)
+        registration = Registration.objects.get(
+                                workshop=workshop,
+                                profile=self.profile
+                                )
+        self.assertEqual(registration.status, Registration.ACCEPTED)
+
+    def test_save_keeps_counters(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        stale = Workshop.objects.get(pk=workshop.pk)
+        workshop.register(self.profile)
+        stale.update_title("tomorrow")
+        workshop.refresh_from_db()
+        self.assertEqual(workshop.title, "tomorrow")
+        self.assertEqual(workshop.accepted_count, 1)
+
+    def assertCounters(self, workshop, accepted, pending, waitlisted, present):
+        workshop.refresh_from_db()
+        self.assertEqual(
+                (workshop.accepted_count, workshop.pending_count,
+                 workshop.waitlisted_count, workshop.present_count),
+                (accepted, pending, waitlisted, present),
+                )
+
+    def test_counters(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        for profile in (self.profile, self.profile2, self.profile3):
+            workshop.register(profile)
+        self.assertCounters(workshop, 1, 0, 2, 0)
+        self.assertEqual(workshop.count_registrations(), 3)
+
+        workshop.cancel_registration(self.profile)
+        self.assertCounters(workshop, 1, 0, 1, 0)
+
+        registration = workshop.registration_set.get(profile=self.profile2)
+        registration.present = True
+        registration.save()
+        self.assertCounters(workshop, 1, 0, 1, 1)
+        # loaded without the counted fields
+        registration = workshop.registration_set.only('pk').get(
+                                                    profile=self.profile2)
+        registration.status = Registration.PENDING
+        registration.save()
+        self.assertCounters(workshop, 0, 1, 1, 1)
+
+        workshop.registration_set.get(profile=self.profile3).delete()
+        self.assertCounters(workshop, 0, 1, 0, 1)
+
+    def test_refuse_releases_seat(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        workshop.register(self.profile)
+        registration = workshop.registration_set.get(profile=self.profile)
+        registration.refuse()
+        self.assertCounters(workshop, 0, 0, 0, 0)
+        registration.accept()
+        self.assertCounters(workshop, 1, 0, 0, 0)
+        # a moderator may accept beyond the seats
+        registration = Registration.objects.create(workshop=workshop,
+                                                   profile=self.profile2)
+        registration.accept()
+        self.assertCounters(workshop, 2, 0, 0, 0)
+        Workshop.recount_registrations(Workshop.objects.filter(pk=workshop.pk))
+        self.assertCounters(workshop, 2, 0, 0, 0)
+
+    def test_admin_status_edits(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        registration = Registration.objects.create(workshop=workshop,
+                                                   profile=self.profile)
+        self.assertCounters(workshop, 0, 1, 0, 0)
+        admin = User.objects.create_superuser('admin', 'admin@yopmail.com',
+                                              'password')
+        self.client.force_login(admin)
+        url = reverse('admin:openclass_registration_change',
+                      args=(registration.pk,))
+        now = timezone.localtime()
+
+        def edit(status):
+            response = self.client.post(url, {
+                            'workshop': workshop.pk,
+                            'profile': self.profile.pk,
+                            'status': status,
+                            'date_cancel_0': now.date().isoformat(),
+                            'date_cancel_1': now.strftime('%H:%M:%S'),
+                            })
+            self.assertEqual(response.status_code, 302)
+
+        edit(Registration.ACCEPTED)
+        self.assertCounters(workshop, 1, 0, 0, 0)
+        edit(Registration.CANCELED)
+        self.assertCounters(workshop, 0, 0, 0, 0)
+        # the seat is free again
+        self.assertTrue(workshop.register(self.profile2))
+        self.assertCounters(workshop, 1, 0, 0, 0)
+
+    def test_recount_registrations(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        workshop.register(self.profile)
+        workshop.register(self.profile2)
+        workshop.registration_set.filter(profile=self.profile).update(
+                                                                present=True)
+        Workshop.objects.filter(pk=workshop.pk).update(
+                                                accepted_count=0,
+                                                waitlisted_count=5,
+                                                )
+        Workshop.recount_registrations(Workshop.objects.all())
+        self.assertCounters(workshop, 1, 0, 1, 1)
+
+    def test_recount_waitlists_pending(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        # what the FIFO registrations without a seat used to be
+        for profile in (self.profile, self.profile2, self.profile3):
+            Registration.objects.create(workshop=workshop, profile=profile)
+        workshop.registration_set.filter(profile=self.profile).update(
+                                            status=Registration.ACCEPTED)
+        Workshop.objects.filter(pk=workshop.pk).update(seats_number=2)
+        call_command('recount_registrations', stdout=StringIO())
+        self.assertCounters(workshop, 2, 0, 1, 0)
+        self.assertEqual(workshop.waitlist().get().profile, self.profile3)
+
+    def test_status_counts(self):
+        cache.clear()
+        with self.assertNumQueries(1):
+            counts = Workshop.objects.status_counts()
+        self.assertEqual(counts[Workshop.DONE], 1)
+        self.assertEqual(counts[Workshop.ACCEPTED], 1)
+        self.assertEqual(counts[Workshop.PENDING], 0)
+        with self.assertNumQueries(0):
+            Workshop.objects.status_counts()
+
+    def search(self, text):
+        response = self.client.post(reverse('openclass:workshops_list_filter'),
+                                    {'title': text},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        return list(response.context['workshop_list'])
+
+    def test_search(self):
+        workshops = self.search('pwnign')
+        self.assertEqual([w.title for w in workshops], ['PWNign in user_land'])
+
+    @skipUnless(connection.vendor == 'postgresql', "full text search")
+    def test_search_rank(self):
+        workshop = Workshop.objects.get(title='tommorow')
+        self.assertEqual(len(self.search('exploits')), 2)
+        # a match in the title ranks above a match in the description
+        workshop.update_title("exploit dev 101")
+        self.assertEqual(self.search('exploits')[0], workshop)
 
     def test_update_title(self):
         w = Workshop.objects.all()[0]
@@ -396,3 +661,367 @@ class WorkshopTest(TestCase):
         ret = w.update_location(new_location)
         self.assertEqual(ret, False)
         self.assertEqual(w.location, old_location)
+
+
+class AttendanceTest(TestCase):
+    """Bulk check-in of the members of a workshop"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = Workshop.objects.create(
+                        title='check-in',
+                        description="door scanner",
+                        seats_number=10,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() - timedelta(minutes=5),
+                        duration=timedelta(hours=2),
+                        location='amphi c',
+                        status=Workshop.ACCEPTED)
+        cls.profiles = []
+        for i in range(4):
+            user = User.objects.create(username='member%d' % i,
+                                       is_staff=(i == 0))
+            profile = Profile.objects.create(user=user, phone_number='0555')
+            Registration.objects.create(
+                        workshop=cls.workshop,
+                        profile=profile,
+                        date_registration=timezone.now(),
+                        status=(Registration.WAITLISTED if i == 3
+                                else Registration.ACCEPTED))
+            cls.profiles.append(profile)
+        cls.pks = [profile.pk for profile in cls.profiles]
+
+    def count_presents(self):
+        self.workshop.refresh_from_db()
+        return self.workshop.count_presents()
+
+    def get_scores(self):
+        return [p.score for p in Profile.objects.order_by('pk')]
+
+    def test_mark_attendance(self):
+        points = config.POINTS_ATTENDANCE
+        # the waitlisted member isn't checked in
+        self.assertEqual(self.workshop.mark_attendance(self.pks), self.pks[:3])
+        self.assertEqual(self.get_scores(), [points] * 3 + [0])
+        self.assertEqual(self.count_presents(), 3)
+        # already present, not credited twice
+        self.assertEqual(self.workshop.mark_attendance(self.pks[:2]), [])
+        self.assertEqual(self.get_scores(), [points] * 3 + [0])
+        self.assertEqual(
+                self.workshop.mark_attendance(self.pks[:1], present=False),
+                self.pks[:1],
+                )
+        self.assertEqual(self.count_presents(), 2)
+
+    def test_not_started(self):
+        self.workshop.start_date = timezone.now() + timedelta(days=1)
+        self.assertIsNone(self.workshop.mark_attendance(self.pks))
+
+    def test_bulk_attendance_view(self):
+        self.client.force_login(self.profiles[0].user)
+        url = reverse('openclass:moderation_workshop_bulk_attendance',
+                      args=(self.workshop.pk,))
+        response = self.client.post(
+                            url,
+                            json.dumps({'profiles': self.pks[1:3]}),
+                            content_type='application/json',
+                            )
+        self.assertEqual(response.json(),
+                         {'status': 'ok', 'changed': self.pks[1:3]})
+        response = self.client.post(url, {'profile': self.pks[1],
+                                          'present': '0'})
+        self.assertRedirects(
+                response,
+                reverse('openclass:moderation_workshop_attendance',
+                        args=(self.workshop.pk,)),
+                )
+        self.assertEqual(self.count_presents(), 1)
+        response = self.client.post(url, '{"profiles": 1}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        # not a boolean, rather than present
+        response = self.client.post(
+                            url,
+                            json.dumps({'profiles': self.pks[2:3],
+                                        'present': 'false'}),
+                            content_type='application/json',
+                            )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'profile': self.pks[2],
+                                          'present': 'no'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.count_presents(), 1)
+
+    def test_bulk_attendance_not_started(self):
+        Workshop.objects.filter(pk=self.workshop.pk).update(
+                            start_date=timezone.now() + timedelta(hours=1)
+                            )
+        self.client.force_login(self.profiles[0].user)
+        url = reverse('openclass:moderation_workshop_bulk_attendance',
+                      args=(self.workshop.pk,))
+        response = self.client.post(url, {'profile': self.pks[1]})
+        self.assertContains(response, "hasn't started yet", status_code=409)
+        self.assertEqual(self.count_presents(), 0)
+
+    def checkin(self, token, door_key=None):
+        if door_key is None:
+            door_key = self.workshop.door_key()
+        return self.client.post(reverse('openclass:checkin', args=(token,)),
+                                HTTP_X_DOOR_KEY=door_key)
+
+    def test_checkin(self):
+        registration = Registration.objects.get(profile=self.profiles[1])
+        token = registration.checkin_token()
+        self.assertEqual(self.checkin(token).json(), {'status': 'checked_in'})
+        self.assertEqual(self.checkin(token).json(),
+                         {'status': 'already_checked_in'})
+        self.assertEqual(self.count_presents(), 1)
+
+        registration = Registration.objects.get(profile=self.profiles[3])
+        self.assertEqual(self.checkin(registration.checkin_token()).json(),
+                         {'status': 'not_registered'})
+
+        # signed by us, but not as a check-in token
+        forged = signing.dumps([self.workshop.pk, self.profiles[2].pk])
+        self.assertEqual(self.checkin(forged).status_code, 400)
+        # expired
+        registration = Registration.objects.get(profile=self.profiles[2])
+        expired = timezone.now() - Registration.CHECKIN_MAX_AGE
+        with mock.patch('time.time', return_value=expired.timestamp() - 1):
+            token = registration.checkin_token()
+        self.assertEqual(self.checkin(token).json(), {'status': 'invalid_token'})
+        self.assertEqual(self.count_presents(), 1)
+
+    def test_checkin_door_key(self):
+        token = Registration.objects.get(profile=self.profiles[1]).checkin_token()
+        # the member's own token isn't enough
+        response = self.client.post(reverse('openclass:checkin', args=(token,)))
+        self.assertEqual(response.status_code, 403)
+        response = self.checkin(token, door_key=token)
+        self.assertEqual(response.status_code, 403)
+        # the key of another workshop
+        other_key = signing.dumps(self.workshop.pk + 1,
+                                  salt=Workshop.DOOR_KEY_SALT)
+        self.assertEqual(self.checkin(token, other_key).json(),
+                         {'status': 'wrong_workshop'})
+        # in the form
+        response = self.client.post(reverse('openclass:checkin', args=(token,)),
+                                    {'door_key': self.workshop.door_key()})
+        self.assertEqual(response.json(), {'status': 'checked_in'})
+
+    def test_checkin_window(self):
+        token = Registration.objects.get(profile=self.profiles[1]).checkin_token()
+        Workshop.objects.filter(pk=self.workshop.pk).update(
+                            start_date=timezone.now() + timedelta(minutes=5)
+                            )
+        self.assertEqual(self.checkin(token).json(),
+                         {'status': 'workshop_not_started'})
+        Workshop.objects.filter(pk=self.workshop.pk).update(
+                            start_date=timezone.now() - timedelta(hours=3)
+                            )
+        self.assertEqual(self.checkin(token).json(),
+                         {'status': 'workshop_over'})
+        self.assertEqual(self.count_presents(), 0)
+
+
+class FeedbackTest(TestCase):
+    """Answers to the multiple choice questions of a workshop"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = Workshop.objects.create(
+                        title='feedback',
+                        description="poll",
+                        seats_number=10,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() - timedelta(days=1),
+                        duration=timedelta(hours=2),
+                        location='amphi c',
+                        status=Workshop.DONE)
+        cls.questions = []
+        for i in range(3):
+            question = MCQuestion.objects.create(question='rate %d' % i)
+            for choice in ('bad', 'good'):
+                question.choices.create(choice=choice)
+            cls.questions.append(question)
+        cls.workshop.mc_questions.set(cls.questions[:2])
+        user = User.objects.create(username='youben11')
+        profile = Profile.objects.create(user=user, phone_number='0555')
+        cls.feedback = Feedback.objects.create(workshop=cls.workshop,
+                                               author=profile,
+                                               submission_date=timezone.now())
+
+    def test_add_answers(self):
+        first, second, other = [
+            [choice.pk for choice in question.choices.order_by('pk')]
+            for question in self.questions
+            ]
+        with self.assertNumQueries(2):
+            count = self.feedback.add_answers({
+                        self.questions[0].pk: first[1],
+                        # a choice of another question
+                        self.questions[1].pk: first[0],
+                        # not a question of the workshop
+                        self.questions[2].pk: other[0],
+                        })
+        self.assertEqual(count, 1)
+        self.assertEqual([c.pk for c in self.feedback.choices.all()],
+                         [first[1]])
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs row level locking")
+class WorkshopConcurrentRegistrationTest(TransactionTestCase):
+    """Fire many registrations at the same time on a FIFO workshop"""
+
+    SEATS_NUMBER = 50
+    MEMBERS_NUMBER = 300
+    WORKERS_NUMBER = 30
+
+    def setUp(self):
+        self.workshop = Workshop.objects.create(
+                        title='opening day',
+                        description="a popular workshop",
+                        required_materials="laptop",
+                        objectives="fill the room",
+                        requirements="none",
+                        seats_number=self.SEATS_NUMBER,
+                        submission_date=timezone.now(),
+                        decision_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(1),
+                        duration=timedelta(minutes=90),
+                        location='amphi c',
+                        registration_politic=Workshop.POL_FIFO,
+                        status=Workshop.ACCEPTED)
+        self.profiles = []
+        for i in range(self.MEMBERS_NUMBER):
+            user = User.objects.create(username='member%d' % i)
+            profile = Profile.objects.create(user=user, phone_number='0555')
+            self.profiles.append(profile)
+
+    def register(self, profile):
+        try:
+            workshop = Workshop.objects.get(pk=self.workshop.pk)
+            return workshop.register(profile)
+        finally:
+            connection.close()
+
+    def test_no_oversell(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS_NUMBER) as executor:
+            results = list(executor.map(self.register, self.profiles))
+
+        self.assertTrue(all(results))
+        accepted = Registration.objects.filter(
+                                workshop=self.workshop,
+                                status=Registration.ACCEPTED,
+                                ).count()
+        self.assertEqual(accepted, self.SEATS_NUMBER)
+        self.workshop.refresh_from_db()
+        self.assertEqual(self.workshop.accepted_count, self.SEATS_NUMBER)
+        self.assertEqual(
+                Registration.objects.filter(workshop=self.workshop).count(),
+                self.MEMBERS_NUMBER)
+
+    def cancel(self, profile):
+        try:
+            workshop = Workshop.objects.get(pk=self.workshop.pk)
+            return workshop.cancel_registration(profile)
+        finally:
+            connection.close()
+
+    def test_cancel_during_registrations(self):
+        # a full workshop, each seat freed while a newcomer registers
+        first = self.profiles[:self.SEATS_NUMBER]
+        for profile in first:
+            self.workshop.register(profile)
+        later = self.profiles[self.SEATS_NUMBER:2 * self.SEATS_NUMBER]
+        jobs = [
+            (job, profile)
+            for pair in zip(first, later)
+            for job, profile in zip((self.cancel, self.register), pair)
+            ]
+        with ThreadPoolExecutor(max_workers=self.WORKERS_NUMBER) as executor:
+            results = list(executor.map(lambda job: job[0](job[1]), jobs))
+
+        self.assertTrue(all(results))
+        # no seat left free while someone waits for one
+        self.assertFalse(self.workshop.waitlist().exists())
+        accepted = Registration.objects.filter(
+                                workshop=self.workshop,
+                                status=Registration.ACCEPTED,
+                                ).count()
+        self.assertEqual(accepted, self.SEATS_NUMBER)
+        self.workshop.refresh_from_db()
+        self.assertEqual(self.workshop.accepted_count, self.SEATS_NUMBER)
+
+
+class WaitlistOnDeleteTest(TransactionTestCase):
+    """A deleted registration hands its seat over once committed"""
+
+    def test_delete_promotes(self):
+        workshop = Workshop.objects.create(
+                        title='tommorow',
+                        description="exploit dev",
+                        seats_number=1,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(1),
+                        duration=timedelta(minutes=90),
+                        location='amphi c',
+                        status=Workshop.ACCEPTED)
+        profiles = []
+        for i in range(3):
+            user = User.objects.create(username='member%d' % i)
+            profile = Profile.objects.create(user=user, phone_number='0555')
+            workshop.register(profile)
+            profiles.append(profile)
+
+        workshop.registration_set.get(profile=profiles[0]).delete()
+        self.assertEqual(workshop.registration_set.get(
+                            profile=profiles[1]).status, Registration.ACCEPTED)
+        workshop.refresh_from_db()
+        self.assertEqual((workshop.accepted_count, workshop.waitlisted_count),
+                         (1, 1))
+        # along with the member
+        profiles[1].user.delete()
+        self.assertEqual(workshop.registration_set.get().status,
+                         Registration.ACCEPTED)
+        # along with the workshop
+        workshop.delete()
+
+
+class WorkshopStatusCountsTest(TransactionTestCase):
+    """The cached counts are dropped when a workshop changes its status"""
+
+    def test_invalidation(self):
+        profile = Profile.objects.create(
+                        user=User.objects.create(username='youben11'),
+                        phone_number='0555',
+                        )
+        workshop = Workshop.objects.create(
+                        title='tommorow',
+                        description="exploit dev",
+                        required_materials="laptop, linux OS",
+                        objectives="debuggin, exploit dev",
+                        requirements="C programming, Linux basics",
+                        seats_number=1,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(1),
+                        duration=timedelta(minutes=90),
+                        location='amphi c',
+                        animator=profile,
+                        )
+        counts = Workshop.objects.status_counts()
+        self.assertEqual(counts[Workshop.PENDING], 1)
+        workshop.accept(profile)
+        counts = Workshop.objects.status_counts()
+        self.assertEqual(counts[Workshop.PENDING], 0)
+        self.assertEqual(counts[Workshop.ACCEPTED], 1)
+
+        # edited in the admin
+        workshop.status = Workshop.REFUSED
+        workshop.save()
+        counts = Workshop.objects.status_counts()
+        self.assertEqual(counts[Workshop.ACCEPTED], 0)
+        self.assertEqual(counts[Workshop.REFUSED], 1)
+        workshop.delete()
+        counts = Workshop.objects.status_counts()
+        self.assertEqual(counts[Workshop.REFUSED], 0)
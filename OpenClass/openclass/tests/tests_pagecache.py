@@ -0,0 +1,71 @@
+from django.test import TransactionTestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from openclass.models import *
+
+
+class PageCacheTest(TransactionTestCase):
+    """Pages cached for the anonymous visitors, invalidated on commit"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_cached_page(self):
+        url = reverse('openclass:badges_list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalidation(self):
+        badges_url = reverse('openclass:badges_list')
+        faq_url = reverse('openclass:faq')
+        self.client.get(badges_url)
+        self.client.get(faq_url)
+        Badge.objects.create(name='Early bird', description='First one',
+                             img='badges/1456132.png')
+        response = self.client.get(badges_url)
+        self.assertContains(response, 'Early bird')
+        # the other pages are still cached
+        with self.assertNumQueries(0):
+            self.client.get(faq_url)
+
+    def test_authenticated(self):
+        user = User.objects.create(username='youben11')
+        Profile.objects.create(user=user, phone_number='0555')
+        self.client.force_login(user)
+        url = reverse('openclass:about')
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertContains(response, '@youben11')
+
+    def test_seat_counts(self):
+        workshop = Workshop.objects.create(
+                        title='Binary Analysis',
+                        description="Learn how to RE B",
+                        seats_number=2,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(days=1),
+                        duration=timedelta(hours=2),
+                        location='amphi c',
+                        status=Workshop.ACCEPTED,
+                        )
+        url = reverse('openclass:workshops_list')
+        response = self.client.get(url)
+        # a count would be stale until the workshop is full
+        self.assertNotContains(response, 'seats left')
+        self.assertContains(response, 'Seats available')
+        workshop.take_seat()
+        # the users get a fresh page
+        user = User.objects.create(username='youben11')
+        Profile.objects.create(user=user, phone_number='0555')
+        self.client.force_login(user)
+        self.assertContains(self.client.get(url), '1 seats left')
+        self.client.logout()
+        workshop.take_seat()
+        response = self.client.get(url)
+        self.assertContains(response, '<span class="badge badge-danger">Full')
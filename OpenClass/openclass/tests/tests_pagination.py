@@ -0,0 +1,169 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from datetime import timedelta
+from unittest import mock
+from django.utils import timezone
+from openclass.models import *
+from openclass import pagination
+
+
+def create_workshop(title, start_date, status=Workshop.ACCEPTED):
+    return Workshop.objects.create(
+                        title=title,
+                        description="keyset",
+                        required_materials="laptop",
+                        objectives="pagination",
+                        requirements="none",
+                        seats_number=10,
+                        submission_date=timezone.now(),
+                        start_date=start_date,
+                        duration=timedelta(hours=2),
+                        location='amphi c',
+                        status=status)
+
+
+class PaginationTest(TestCase):
+    """Keyset pagination of the workshop lists"""
+
+    @classmethod
+    def setUpTestData(cls):
+        start_date = timezone.now() + timedelta(days=1)
+        # two workshops per date to break ties on the pk
+        cls.workshops = [
+            create_workshop('workshop %d' % i,
+                            start_date + timedelta(days=i // 2))
+            for i in range(7)
+            ]
+
+    def test_paginate(self):
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = pagination.paginate(
+                                Workshop.objects.all(),
+                                ('start_date', 'pk'),
+                                cursor,
+                                page_size=3,
+                                )
+            pages.append(page)
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), self.workshops)
+
+    def test_paginate_descending(self):
+        page, cursor = pagination.paginate(
+                            Workshop.objects.all(),
+                            ('-start_date', '-pk'),
+                            page_size=4,
+                            )
+        page2, cursor = pagination.paginate(
+                            Workshop.objects.all(),
+                            ('-start_date', '-pk'),
+                            cursor,
+                            page_size=4,
+                            )
+        self.assertEqual(page + page2, self.workshops[::-1])
+        self.assertIsNone(cursor)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage',
+                       pagination.encode_cursor([1]),
+                       pagination.encode_cursor(['yesterday', 1])):
+            with self.assertRaises(pagination.InvalidCursor):
+                pagination.paginate(Workshop.objects.all(),
+                                    ('start_date', 'pk'),
+                                    cursor)
+
+    def test_upcoming_workshops_list(self):
+        patcher = mock.patch.object(pagination, 'PAGE_SIZE', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        response = self.client.get(reverse('openclass:upcoming_workshops_list'))
+        self.assertEqual(list(response.context['workshop_list']),
+                         self.workshops[:5])
+        cursor = response.context['next_cursor']
+        response = self.client.post(
+                            reverse('openclass:workshops_list_filter'),
+                            {'upcoming': 'upcoming', 'cursor': cursor},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                            )
+        self.assertEqual(list(response.context['workshop_list']),
+                         self.workshops[5:])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertNotContains(response, 'tag-list')
+
+    def test_search_pages(self):
+        patcher = mock.patch.object(pagination, 'PAGE_SIZE', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        url = reverse('openclass:workshops_list_filter')
+        data = {'title': 'workshop'}
+        response = self.client.post(url, data,
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        workshops = list(response.context['workshop_list'])
+        data['cursor'] = response.context['next_cursor']
+        response = self.client.post(url, data,
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        workshops += response.context['workshop_list']
+        self.assertEqual(sorted(workshops, key=lambda w: w.pk),
+                         self.workshops)
+
+
+class MembersListTest(TestCase):
+    """Paginated and searchable members directory"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='security')
+        cls.users = []
+        for i, (first_name, last_name) in enumerate((
+                            ('Ada', 'Lovelace'),
+                            ('Alan', 'Turing'),
+                            ('Grace', 'Hopper'),
+                            ('Linus', 'Torvalds'),
+                            ('Ken', 'Thompson'),
+                            )):
+            user = User.objects.create_user(
+                            username='member%d' % i,
+                            first_name=first_name,
+                            last_name=last_name,
+                            password='password',
+                            )
+            profile = Profile.objects.create(user=user, phone_number='0555')
+            if i % 2:
+                profile.interests.add(cls.tag)
+            cls.users.append(user)
+
+    def setUp(self):
+        self.client.force_login(self.users[0])
+
+    def get_members(self, **data):
+        response = self.client.get(reverse('openclass:members_list'), data)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['users']), response.context['next_cursor']
+
+    def test_pages(self):
+        patcher = mock.patch.object(pagination, 'PAGE_SIZE', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        users, cursor = self.get_members()
+        self.assertEqual(users, self.users[:3])
+        users, cursor = self.get_members(cursor=cursor)
+        self.assertEqual(users, self.users[3:])
+        self.assertIsNone(cursor)
+
+    def test_search(self):
+        self.assertEqual(self.get_members(q='al')[0], [self.users[1]])
+        self.assertEqual(self.get_members(q='t')[0], self.users[1:5:2] +
+                                                     self.users[4:])
+        self.assertEqual(self.get_members(q='ken th')[0], [self.users[4]])
+        self.assertEqual(self.get_members(q='member3')[0], [self.users[3]])
+        self.assertEqual(self.get_members(q='uring')[0], [])
+
+    def test_tag(self):
+        users, cursor = self.get_members(tag=self.tag.pk)
+        self.assertEqual(users, [self.users[1], self.users[3]])
+        users, cursor = self.get_members(tag=self.tag.pk, q='linus')
+        self.assertEqual(users, [self.users[3]])
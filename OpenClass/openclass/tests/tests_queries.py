@@ -0,0 +1,268 @@
+import time
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.urls import reverse
+from datetime import date, timedelta
+from unittest import mock
+from django.utils import timezone
+from openclass.models import *
+from openclass import leaderboard
+
+# seeded volumes, large enough for an N+1 to blow any of the budgets
+NB_TAGS = 8
+NB_MEMBERS = 30
+NB_WORKSHOPS = 40
+NB_REGISTRATIONS = 10 # per member
+NB_BADGES = 6
+# upper bound of the time to serve a page, in seconds
+MAX_DURATION = 2
+
+
+class QueryCountTest(TestCase):
+    """Upper bounds on the queries of every page, on a seeded database.
+
+    The budgets don't depend on the volumes: a page looping over the
+    workshops or the members with a query per row must fail here."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # bulk_create only sets the pks on PostgreSQL
+        tags = [
+            Tag.objects.create(name='tag%d' % i) for i in range(NB_TAGS)
+            ]
+        badges = [
+            Badge.objects.create(name='badge%d' % i,
+                                 description='badge',
+                                 img='badges/1456132.png')
+            for i in range(NB_BADGES)
+            ]
+        FAQ.objects.bulk_create(
+                    FAQ(question='question %d' % i, answer='answer')
+                    for i in range(10)
+                    )
+
+        cls.profiles = []
+        for i in range(NB_MEMBERS + 1):
+            user = User.objects.create_user(
+                            username='member%d' % i,
+                            email='member%d@yopmail.com' % i,
+                            password='password',
+                            is_staff=(i == NB_MEMBERS),
+                            )
+            profile = Profile.objects.create(user=user,
+                                             phone_number='0555',
+                                             birthday=date(1995, 1, 1),
+                                             score=i)
+            Preference.objects.create(profile=profile)
+            profile.interests.set(tags[:3])
+            cls.profiles.append(profile)
+        cls.member, cls.moderator = cls.profiles[0], cls.profiles[-1]
+        Have_badge.objects.bulk_create(
+                    Have_badge(badge=badge, profile=profile, priority=1)
+                    for profile in cls.profiles
+                    for badge in badges[:3]
+                    )
+        Link.objects.bulk_create(
+                    Link(profile=profile,
+                         link_type=Link.LINK_GITHUB,
+                         url='https://github.com/%s' % profile.user.username)
+                    for profile in cls.profiles
+                    )
+
+        statuses = (Workshop.ACCEPTED, Workshop.DONE,
+                    Workshop.PENDING, Workshop.REFUSED)
+        cls.workshops = []
+        for i in range(NB_WORKSHOPS):
+            status = statuses[i % len(statuses)]
+            if status == Workshop.DONE:
+                start_date = now - timedelta(days=i + 1)
+            else:
+                start_date = now + timedelta(days=i + 1)
+            workshop = Workshop.objects.create(
+                            title='workshop %d' % i,
+                            description='description of the workshop',
+                            required_materials='laptop',
+                            objectives='objectives',
+                            requirements='requirements',
+                            seats_number=NB_MEMBERS // 2,
+                            submission_date=now,
+                            start_date=start_date,
+                            duration=timedelta(hours=2),
+                            location='amphi c',
+                            status=status,
+                            animator=cls.profiles[i % NB_MEMBERS],
+                            )
+            workshop.topics.set(tags[i % NB_TAGS:i % NB_TAGS + 2])
+            cls.workshops.append(workshop)
+        cls.upcoming = cls.workshops[0]
+        cls.done = cls.workshops[1]
+        cls.pending = cls.workshops[2]
+
+        registrations = []
+        for i, profile in enumerate(cls.profiles[:NB_MEMBERS]):
+            for j in range(NB_REGISTRATIONS):
+                workshop = cls.workshops[(i + j) % NB_WORKSHOPS]
+                registrations.append(Registration(
+                            workshop=workshop,
+                            profile=profile,
+                            date_registration=now,
+                            status=Registration.ACCEPTED,
+                            present=(workshop.status == Workshop.DONE),
+                            ))
+        Registration.objects.bulk_create(registrations)
+        Workshop.recount_registrations(Workshop.objects.all())
+
+        Question.objects.bulk_create(
+                    Question(author=profile, workshop=workshop,
+                             question='why?')
+                    for profile in cls.profiles[:NB_MEMBERS]
+                    for workshop in cls.workshops[:5]
+                    )
+        mc_questions = []
+        for i in range(5):
+            mc_question = MCQuestion.objects.create(question='rate %d' % i)
+            Choice.objects.bulk_create(
+                    Choice(question=mc_question, choice='choice %d' % j)
+                    for j in range(4)
+                    )
+            mc_questions.append(mc_question)
+        for workshop in cls.workshops:
+            workshop.mc_questions.set(mc_questions)
+
+    def setUp(self):
+        # measure the cold pages, not the page cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def assertBudget(self, user, name, budget, args=(), method='get',
+                     data=None, ajax=False):
+        if user is None:
+            self.client.logout()
+        else:
+            self.client.force_login(user)
+        url = reverse('openclass:' + name, args=args)
+        extra = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        with self.subTest(url=url, method=method, ajax=ajax):
+            with self.assertLogs('openclass.requests', 'INFO'), \
+                    CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(self.client, method)(url, data, **extra)
+                duration = time.perf_counter() - start
+            self.assertLess(response.status_code, 400)
+            self.assertLessEqual(
+                    len(queries),
+                    budget,
+                    "%d queries:\n%s" % (
+                        len(queries),
+                        '\n'.join(query['sql'] for query in queries),
+                        ))
+            self.assertLess(duration, MAX_DURATION)
+
+    def test_anonymous(self):
+        self.assertBudget(None, 'index', 1)
+        self.assertBudget(None, 'about', 0)
+        self.assertBudget(None, 'login', 0)
+        self.assertBudget(None, 'badges_list', 1)
+        self.assertBudget(None, 'faq', 1)
+        self.assertBudget(None, 'signup', 3)
+        self.assertBudget(None, 'verify', 1, args=('badtoken',))
+        self.assertBudget(None, 'workshops_list', 3)
+        self.assertBudget(None, 'upcoming_workshops_list', 3)
+        self.assertBudget(None, 'workshops_detail', 4,
+                          args=(self.upcoming.pk,))
+        self.assertBudget(None, 'workshops_list_filter', 3,
+                          method='post', ajax=True,
+                          data={'tag[]': ['tag1', 'tag2'],
+                                'time[]': ['This month'],
+                                'title': 'workshop'})
+        self.assertBudget(None, 'workshops_filter_tag', 2,
+                          method='post', data={'tag': 'tag1'})
+        self.assertBudget(None, 'metrics', 3)
+        # checked in while the workshop is on
+        Workshop.objects.filter(pk=self.done.pk).update(
+                            start_date=timezone.now() - timedelta(minutes=5)
+                            )
+        registration = Registration.objects.get(workshop=self.done,
+                                                profile=self.member)
+        Registration.objects.filter(pk=registration.pk).update(present=False)
+        self.assertBudget(None, 'checkin', 7,
+                          args=(registration.checkin_token(),),
+                          method='post',
+                          data={'door_key': self.done.door_key()})
+
+    def test_member(self):
+        user = self.member.user
+        other = self.profiles[1].user
+        self.assertBudget(user, 'index', 3)
+        self.assertBudget(user, 'about', 2)
+        self.assertBudget(user, 'badges_list', 3)
+        self.assertBudget(user, 'faq', 3)
+        self.assertBudget(user, 'members_list', 4)
+        self.assertBudget(user, 'members_detail', 8,
+                          args=(other.username,))
+        self.assertBudget(user, 'profile', 8)
+        self.assertBudget(user, 'user_questions', 7)
+        self.assertBudget(user, 'prefs', 5)
+        self.assertBudget(user, 'user_registrations', 8)
+        self.assertBudget(user, 'user_settings', 8)
+        self.assertBudget(user, 'submit_workshop', 5)
+        self.assertBudget(user, 'workshops_list', 5)
+        self.assertBudget(user, 'upcoming_workshops_list', 5)
+        self.assertBudget(user, 'workshops_detail', 8,
+                          args=(self.upcoming.pk,))
+        self.assertBudget(user, 'ask_question', 3,
+                          args=(self.upcoming.pk,))
+        self.assertBudget(user, 'workshop_questions_list', 8,
+                          args=(self.upcoming.pk,))
+        self.assertBudget(user, 'feedback', 8, args=(self.done.pk,))
+        answers = {
+            'mc_question_%d' % question.pk: question.choices.all()[0].pk
+            for question in self.done.mc_questions.all()
+            }
+        answers['comment'] = 'great'
+        self.assertBudget(user, 'feedback', 11, args=(self.done.pk,),
+                          method='post', data=answers)
+        # measured on a built ranking, not the shared one
+        with mock.patch.object(leaderboard, 'LEADERBOARD_KEY',
+                               'openclass:test:leaderboard'):
+            self.addCleanup(leaderboard.get_connection().delete,
+                            'openclass:test:leaderboard',
+                            'openclass:test:leaderboard:built')
+            leaderboard.rebuild()
+            self.assertBudget(user, 'leaderboard', 4)
+        self.assertBudget(user, 'register_to_workshop', 9,
+                          method='post',
+                          data={'workshop_pk': self.workshops[12].pk})
+        self.assertBudget(user, 'cancel_registration', 12,
+                          method='post',
+                          data={'workshop_pk': self.upcoming.pk})
+
+    def test_moderator(self):
+        user = self.moderator.user
+        self.assertBudget(user, 'moderation', 4)
+        self.assertBudget(user, 'moderation_workshops', 5)
+        self.assertBudget(user, 'moderation_attendance', 5)
+        self.assertBudget(user, 'moderation_workshop_attendance', 4,
+                          args=(self.done.pk,))
+        self.assertBudget(user, 'moderation_workshop_bulk_attendance', 8,
+                          args=(self.done.pk,), method='post',
+                          data={'profile': [p.pk for p in self.profiles],
+                                'present': '0'},
+                          ajax=True)
+        self.assertBudget(user, 'moderation_workshop_user_attendance', 6,
+                          args=(self.done.pk, self.member.pk))
+        self.assertBudget(user, 'moderation_accepted_workshops', 5)
+        self.assertBudget(user, 'moderation_accepted_workshops', 5,
+                          ajax=True)
+        self.assertBudget(user, 'moderation_done_workshops', 5)
+        self.assertBudget(user, 'moderation_submitted_workshops', 8)
+        self.assertBudget(user, 'moderation_submitted_workshops', 5,
+                          ajax=True)
+        self.assertBudget(user, 'moderation_submitted_workshops_decision',
+                          6, method='post',
+                          data={'workshop_pk': self.pending.pk,
+                                'decision': 'accept'})
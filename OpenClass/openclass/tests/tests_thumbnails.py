@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from datetime import timedelta
+from unittest import mock
+from django.utils import timezone
+from PIL import Image
+from openclass.models import *
+
+
+def make_image(name, size, mode='RGB', format='PNG'):
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(buffer, format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ThumbnailsTest(TestCase):
+    """Resized derivatives made at upload time"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root
+
+        user = User.objects.create(username='youben11')
+        self.profile = Profile.objects.create(user=user, phone_number='0555')
+        self.workshop = Workshop.objects.create(
+                        title='Binary Analysis',
+                        description="Learn how to RE B",
+                        seats_number=10,
+                        submission_date=timezone.now(),
+                        start_date=timezone.now() + timedelta(days=1),
+                        duration=timedelta(hours=2),
+                        location='amphi c',
+                        status=Workshop.ACCEPTED,
+                        )
+
+    def open_derivative(self, prefix, size, extension):
+        path = '%s.%s.%s' % (prefix, size, extension)
+        return Image.open(os.path.join(self.media_root, path))
+
+    def test_profile_photo(self):
+        self.profile.photo = make_image('me.png', (600, 400), 'RGBA')
+        self.profile.save()
+        prefix = Profile.objects.get(pk=self.profile.pk).thumbnails_prefix
+        self.assertEqual(prefix, self.profile.thumbnails_prefix)
+        self.assertTrue(prefix.startswith('profile/photos/youben11.'))
+        for name, size in Profile.PHOTO_SIZES.items():
+            with self.open_derivative(prefix, name, 'webp') as image:
+                self.assertEqual(image.size, (size.width, size.height))
+            with self.open_derivative(prefix, name, 'jpg') as image:
+                self.assertEqual(image.format, 'JPEG')
+                self.assertEqual(image.mode, 'RGB')
+
+        thumbnail = self.profile.photo_thumbnails()['small']
+        self.assertEqual(thumbnail.url, '/media/%s.small.jpg' % prefix)
+        self.assertEqual(thumbnail.webp_url, '/media/%s.small.webp' % prefix)
+
+        # a new photo gets new names
+        self.profile.photo = make_image('me.jpg', (300, 300), format='JPEG')
+        self.profile.save()
+        self.assertNotEqual(self.profile.thumbnails_prefix, prefix)
+
+    def test_cover_keeps_ratio(self):
+        self.workshop.cover_img = make_image('cover.png', (2000, 500))
+        self.workshop.save()
+        self.workshop.refresh_from_db()
+        prefix = self.workshop.thumbnails_prefix
+        with self.open_derivative(prefix, 'card', 'jpg') as image:
+            self.assertEqual(image.size, (640, 160))
+
+        # a later save of a stale copy keeps the thumbnails
+        stale = Workshop.objects.get(pk=self.workshop.pk)
+        stale.thumbnails_prefix = ''
+        stale.save()
+        self.workshop.refresh_from_db()
+        self.assertEqual(self.workshop.thumbnails_prefix, prefix)
+
+    def test_without_thumbnails(self):
+        # the default photo is served as it is
+        thumbnail = self.profile.photo_thumbnails()['medium']
+        self.assertEqual(thumbnail.url, self.profile.photo.url)
+        self.assertIsNone(thumbnail.webp_url)
+        # not a picture
+        self.profile.photo = SimpleUploadedFile('me.png', b'not an image')
+        with self.assertLogs('openclass.thumbnails', 'ERROR'):
+            self.profile.save()
+        self.assertEqual(self.profile.thumbnails_prefix, '')
+
+    def test_without_webp(self):
+        # Pillow built without libwebp
+        save = dict(Image.SAVE)
+        del save['WEBP']
+        with mock.patch.dict(Image.SAVE, save, clear=True), \
+                mock.patch('PIL.features.check', return_value=False):
+            self.profile.photo = make_image('me.png', (600, 400))
+            self.profile.save()
+            prefix = self.profile.thumbnails_prefix
+            with self.open_derivative(prefix, 'small', 'jpg') as image:
+                self.assertEqual(image.format, 'JPEG')
+            self.assertFalse(os.path.exists(os.path.join(
+                        self.media_root, '%s.small.webp' % prefix)))
+            thumbnail = self.profile.photo_thumbnails()['small']
+            self.assertEqual(thumbnail.url, '/media/%s.small.jpg' % prefix)
+            self.assertIsNone(thumbnail.webp_url)
+
+            # an encoder missing anyway is logged, not a server error
+            with mock.patch('PIL.features.check', return_value=True), \
+                    self.assertLogs('openclass.thumbnails', 'ERROR'):
+                self.profile.photo = make_image('me.jpg', (300, 300))
+                self.profile.save()
+            self.assertEqual(self.profile.thumbnails_prefix, '')
+
+    def test_picture(self):
+        template = Template('{% load images %}'
+                            '{% picture thumbnail class="avatar" alt=alt %}')
+        thumbnail = self.profile.photo_thumbnails()['small']
+        html = template.render(Context({'thumbnail': thumbnail,
+                                        'alt': '<b>'}))
+        self.assertHTMLEqual(html, '<img src="%s" class="avatar" '
+                                   'alt="&lt;b&gt;">' % thumbnail.url)
+
+        self.profile.photo = make_image('me.png', (600, 400))
+        self.profile.save()
+        thumbnail = self.profile.photo_thumbnails()['small']
+        html = template.render(Context({'thumbnail': thumbnail, 'alt': ''}))
+        self.assertHTMLEqual(html, '<picture><source srcset="%s" '
+                                   'type="image/webp"><img src="%s" '
+                                   'class="avatar" alt=""></picture>' % (
+                                        thumbnail.webp_url, thumbnail.url))
+
+    def test_make_thumbnails(self):
+        shutil.copytree(
+                os.path.join(settings.BASE_DIR, 'media', 'default'),
+                os.path.join(self.media_root, 'default'),
+                )
+        out = StringIO()
+        call_command('make_thumbnails', stdout=out)
+        self.assertIn('1 profile thumbnail(s) made', out.getvalue())
+        self.profile.refresh_from_db()
+        self.assertNotEqual(self.profile.thumbnails_prefix, '')
+        self.assertIsNotNone(self.profile.photo_thumbnails()['small'].webp_url)
+        # up to date
+        out = StringIO()
+        call_command('make_thumbnails', stdout=out)
+        self.assertIn('0 profile thumbnail(s) made', out.getvalue())
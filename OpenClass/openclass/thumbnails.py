@@ -0,0 +1,127 @@
+"""Resized derivatives of the uploaded images, served by the pages
+instead of the originals.
+
+When an image is uploaded, every size of its model (Profile.PHOTO_SIZES,
+Workshop.COVER_SIZES) is made from it, in WebP and in JPEG for the
+browsers without WebP. They are stored next to the original and named
+after its content hash:
+
+    profile/photos/youben.3f2a9c41d0b7.small.webp
+
+The model keeps the common prefix of the names (thumbnails_prefix). A new
+upload gets new names, so browsers can cache them for good. Images
+without derivatives (uploaded before, the defaults) are served as they
+are until ./manage.py make_thumbnails. Without the WebP support of Pillow
+(libwebp missing at build time) only the JPEG ones are made and served."""
+
+import hashlib
+import logging
+import os
+from collections import namedtuple
+from io import BytesIO
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+HASH_LEN = 12
+# (extension, Pillow format), the last one is the fallback
+FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+QUALITY = 80
+# JPEG has no transparency
+BACKGROUND = (255, 255, 255)
+
+# crop to exactly width x height, or shrink to fit within it
+Size = namedtuple('Size', ('width', 'height', 'crop'))
+# webp_url is None when the image has no derivatives or no WebP one
+Thumbnail = namedtuple('Thumbnail', ('url', 'webp_url'))
+
+
+def get_formats():
+    """Get the FORMATS this Pillow can write."""
+
+    return [(extension, format) for extension, format in FORMATS
+            if format != 'WEBP' or features.check('webp')]
+
+def get_prefix(field_file):
+    """Get the prefix of the derivatives of an image: its name without
+    the extension and its content hash."""
+
+    digest = hashlib.sha1()
+    for chunk in field_file.chunks():
+        digest.update(chunk)
+    root = os.path.splitext(field_file.name)[0]
+    return '%s.%s' % (root, digest.hexdigest()[:HASH_LEN])
+
+def resize(image, size):
+    if size.crop:
+        return ImageOps.fit(image, (size.width, size.height), Image.LANCZOS)
+    image = image.copy()
+    # never enlarged
+    image.thumbnail((size.width, size.height), Image.LANCZOS)
+    return image
+
+def encode(image, format):
+    if format == 'JPEG' and image.mode == 'RGBA':
+        flat = Image.new('RGB', image.size, BACKGROUND)
+        flat.paste(image, mask=image.split()[-1])
+        image = flat
+    buffer = BytesIO()
+    image.save(buffer, format, quality=QUALITY, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+def generate(field_file, sizes):
+    """Make the missing derivatives of a stored image.
+    Get their prefix, or '' if the image can't be read."""
+
+    try:
+        prefix = get_prefix(field_file)
+        field_file.open('rb')
+        with Image.open(field_file) as image:
+            # phone pictures are stored sideways with an EXIF orientation
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or \
+                        'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        formats = get_formats()
+        for name, size in sizes.items():
+            resized = None
+            for extension, format in formats:
+                path = '%s.%s.%s' % (prefix, name, extension)
+                if field_file.storage.exists(path):
+                    continue
+                if resized is None:
+                    resized = resize(image, size)
+                field_file.storage.save(path, encode(resized, format))
+    # KeyError: a format Pillow has no encoder for
+    except (OSError, ValueError, KeyError):
+        logger.exception("can't make the thumbnails of %s", field_file.name)
+        return ''
+    finally:
+        field_file.close()
+    return prefix
+
+def is_current(field_file, prefix):
+    """Tell if the derivatives of prefix are the ones of the image, not
+    of a previous one."""
+
+    root = os.path.splitext(field_file.name)[0]
+    return bool(prefix) and prefix.rsplit('.', 1)[0] == root
+
+def get_thumbnails(field_file, prefix, sizes):
+    """Get the {size name: Thumbnail} of an image, the original when
+    the derivatives are missing or belong to a previous image."""
+
+    if not is_current(field_file, prefix):
+        return {name: Thumbnail(field_file.url, None) for name in sizes}
+    storage = field_file.storage
+    has_webp = FORMATS[0] in get_formats()
+    webp, fallback = FORMATS[0][0], FORMATS[-1][0]
+    return {
+        name: Thumbnail(
+                storage.url('%s.%s.%s' % (prefix, name, fallback)),
+                storage.url('%s.%s.%s' % (prefix, name, webp))
+                    if has_webp else None,
+                )
+        for name in sizes
+        }
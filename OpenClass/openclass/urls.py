@@ -11,12 +11,15 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')),
     # path('accounts/logout', LogoutView.as_view(), name="logout"),
     path('badges/', views.badges_list, name='badges_list'),
+    path('checkin/<str:token>/', views.checkin, name='checkin'),
     path('faq/', views.faq, name='faq'),
+    path('metrics/', views.metrics_endpoint, name='metrics'),
     path('members/', views.members_list, name='members_list'),
     path('members/<str:username>/', views.members_detail, name='members_detail'),
     path('moderation/', views.moderation, name='moderation'),
     path('moderation/attendance/', views.moderation_attendance, name='moderation_attendance'),
     path('moderation/attendance/<int:workshop_pk>/', views.moderation_workshop_attendance, name='moderation_workshop_attendance'),
+    path('moderation/attendance/<int:workshop_pk>/bulk/', views.moderation_workshop_bulk_attendance, name='moderation_workshop_bulk_attendance'),
     path('moderation/attendance/<int:workshop_pk>/<int:user_pk>/', views.moderation_workshop_user_attendance, name='moderation_workshop_user_attendance'),
     path('moderation/accepted_workshops', views.moderation_accepted_workshops, name='moderation_accepted_workshops'),
     path('moderation/done_workshops', views.moderation_done_workshops, name='moderation_done_workshops'),
@@ -9,37 +9,43 @@ from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 from django.db.models import Q
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.core import signing
 from .models import *
 from .forms import *
 from . import email
+from . import leaderboard
+from . import metrics
+from . import pagination
+from . import search
+from .pagecache import cache_anonymous_page
 import datetime
+import json
 
 def is_moderator(user):
     return user.is_staff
 
+@cache_anonymous_page('workshops')
 def index(request):
     best_workshops = Workshop.objects.all()
     context = {"best_workshops": best_workshops}
     return render(request, "openclass/home.html", context)
 
+@cache_anonymous_page()
 def about(request):
     return render(request, "openclass/about.html")
 @login_required
 @user_passes_test(is_moderator)
 def moderation(request):
     menu_item = "dashboard"
-    submitted_workshops = Workshop.objects.filter(status=Workshop.PENDING)
-    accepted_workshops = Workshop.objects.filter(status=Workshop.ACCEPTED)
-    refused_workshops = Workshop.objects.filter(status=Workshop.REFUSED)
-    done_workshops = Workshop.objects.filter(status=Workshop.DONE)
-    workshops = Workshop.objects.filter(status=Workshop.ACCEPTED)
+    status_counts = Workshop.objects.status_counts()
     users = User.objects.all().order_by('-date_joined')[:4]
     context = {
-                "workshops":workshops,
-                "submitted_workshops":submitted_workshops,
-                "accepted_workshops":accepted_workshops,
-                "refused_workshops":refused_workshops,
-                "done_workshops":done_workshops,
+                "submitted_count":status_counts[Workshop.PENDING],
+                "accepted_count":status_counts[Workshop.ACCEPTED],
+                "refused_count":status_counts[Workshop.REFUSED],
+                "done_count":status_counts[Workshop.DONE],
                 "menu_item":menu_item,
                 "users":users
               }
@@ -94,10 +100,49 @@ def moderation_attendance(request):
 def moderation_workshop_attendance(request,workshop_pk):
     workshop = get_object_or_404(Workshop, pk = workshop_pk)
     registrations = Registration.objects.all().filter(workshop=workshop)
+    registrations = registrations.select_related('profile__user')
     date_now = timezone.now()
-    context = {"registrations": registrations,"workshop":workshop, "date_now": date_now}
+    context = {"registrations": registrations,"workshop":workshop, "date_now": date_now,
+               "door_key": workshop.door_key()}
     return render(request, "openclass/attendance.html", context)
 
+@login_required
+@user_passes_test(is_moderator)
+@require_POST
+def moderation_workshop_bulk_attendance(request, workshop_pk):
+    """Check in (or out) many members at once, from the attendance page
+    form or from a JSON body {"profiles": [pk, ...], "present": true}
+    sent by a scanner client, which gets a JSON response."""
+
+    workshop = get_object_or_404(Workshop, pk=workshop_pk)
+    is_json = request.content_type == 'application/json'
+    try:
+        if is_json:
+            data = json.loads(request.body.decode())
+            profile_pks = [int(pk) for pk in data['profiles']]
+            present = data.get('present', True)
+        else:
+            profile_pks = [int(pk) for pk in request.POST.getlist('profile')]
+            present = {'1': True, '0': False}[request.POST.get('present', '1')]
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'status': 'invalid_request'}, status=400)
+    # "false" would be true
+    if not isinstance(present, bool):
+        return JsonResponse({'status': 'invalid_request'}, status=400)
+
+    changed = workshop.mark_attendance(profile_pks, present)
+    if not (is_json or request.is_ajax()):
+        if changed is None:
+            # the page tells the workshop hasn't started
+            response = moderation_workshop_attendance(request, workshop_pk)
+            response.status_code = 409
+            return response
+        kwargs = {'workshop_pk': workshop_pk}
+        return redirect(reverse('openclass:moderation_workshop_attendance', kwargs=kwargs))
+    if changed is None:
+        return JsonResponse({'status': 'workshop_not_started'})
+    return JsonResponse({'status': 'ok', 'changed': changed})
+
 @login_required
 @user_passes_test(is_moderator)
 def moderation_workshop_user_attendance(request, workshop_pk, user_pk):
@@ -235,8 +280,11 @@ def workshops_list_filter(request):
             today = timezone.now().date()
             this_week = today + datetime.timedelta(6)
             tomorrow = today + datetime.timedelta(1)
-            # filter according to the tag_names
-            filters = Q(topics__name__in=tag_names)
+            # filter according to the tag_names, with a subquery instead of
+            # a join so the workshops don't need to be deduplicated
+            filters = Q(pk__in=Workshop.objects.filter(
+                                    topics__name__in=tag_names
+                                    ).values('pk'))
             # filter according to the time filters
             if 'Tomorrow' in time_filters:
                 filters |= Q(start_date__date=tomorrow)
@@ -260,7 +308,7 @@ def workshops_list_filter(request):
                             start_date__year=today.year
                             )
             if title_filter:
-                filters |= Q(title__icontains=title_filter)
+                filters |= search.search_filter(title_filter)
             # all filters were ORed to make a final filter
 
             # keep only upcoming workshops
@@ -283,20 +331,45 @@ def workshops_list_filter(request):
             else:
                 filters = Q(status=Workshop.ACCEPTED) | Q(status=Workshop.DONE)
 
-        workshop_list = Workshop.objects.filter(filters).distinct()
-        workshop_list = workshop_list.prefetch_related('topics')
-        context["workshop_list"] = workshop_list
+        workshop_list = Workshop.objects.filter(filters)
+        keys = WORKSHOPS_ORDERING
+        if title_filter:
+            # the most relevant workshops first
+            workshop_list = workshop_list.annotate(
+                                rank=search.search_rank(title_filter)
+                                )
+            keys = ('-rank',) + WORKSHOPS_ORDERING
+        cursor = request.POST.get('cursor', "")
+        context.update(paginate_workshops(workshop_list, keys, cursor))
+        context["cursor"] = cursor
         return render(request, "openclass/listworkshop_item.html", context)
     else:
         raise Http404
 
 
+# workshop lists are paginated by cursor on this ordering
+WORKSHOPS_ORDERING = ('start_date', 'pk')
+
+def paginate_workshops(workshops, keys, cursor):
+    try:
+        workshop_list, next_cursor = pagination.paginate(
+                                        workshops.prefetch_related('topics'),
+                                        keys,
+                                        cursor,
+                                        )
+    except pagination.InvalidCursor:
+        raise Http404
+    return {"workshop_list": workshop_list, "next_cursor": next_cursor}
+
+
+@cache_anonymous_page('workshops')
 def all_workshops(request):
         workshops = Workshop.objects.filter(
                         Q(status=Workshop.ACCEPTED) | Q(status=Workshop.DONE)
-                        ).prefetch_related('topics')
+                        )
         tags = Tag.objects.all()
-        context = {"workshop_list":workshops, "tags":tags}
+        context = {"tags":tags}
+        context.update(paginate_workshops(workshops, WORKSHOPS_ORDERING, None))
         return render(request, "openclass/all_workshops.html", context)
 
 
@@ -304,9 +377,10 @@ def upcoming_workshops_list(request):
     workshops = Workshop.objects.filter(
                                     start_date__gte=timezone.now(),
                                     status=Workshop.ACCEPTED,
-                                    ).prefetch_related('topics')
+                                    )
     tags = Tag.objects.all()
-    context = {"workshop_list": workshops, "tags": tags}
+    context = {"tags": tags}
+    context.update(paginate_workshops(workshops, WORKSHOPS_ORDERING, None))
     return render(request, "openclass/upcoming_workshops.html", context)
 
 
@@ -318,9 +392,8 @@ def workshops_detail(request, workshop_pk):
                         )
     context = {'workshop': workshop}
     if request.user.is_authenticated:
-        context['is_registered'] = request.user.profile.is_registered(workshop)
-        if context['is_registered']:
-            context.update(workshop.check_registration(request.user.profile))
+        context['registration'] = \
+                    request.user.profile.registration_state(workshop)
 
     return render(request, "openclass/workshop.html",context)
 
@@ -331,17 +404,45 @@ def workshops_filter_tag(request):
     result = {'data': workshop_list}
     return render(request,"openclass/listworkshop_item.html",result)
 
+MEMBERS_ORDERING = ('username',)
+
 @login_required
 def members_list(request):
+    query = request.GET.get('q', '').strip()
+    tag = request.GET.get('tag', '')
     filters = Q(is_active=True, is_superuser=False)
-    users = User.objects.filter(filters).prefetch_related('profile')
-    return render(request, "openclass/member_list.html", {"users":users})
+    if query:
+        filters &= search.member_filter(query)
+    if tag.isdigit():
+        filters &= Q(profile__interests=tag)
+    users = User.objects.filter(filters).select_related('profile')
+    try:
+        users, next_cursor = pagination.paginate(
+                                    users,
+                                    MEMBERS_ORDERING,
+                                    request.GET.get('cursor'),
+                                    )
+    except pagination.InvalidCursor:
+        raise Http404
+    context = {
+        "users": users,
+        "next_cursor": next_cursor,
+        "query": query,
+        "tag": tag,
+        "tags": Tag.objects.all(),
+    }
+    return render(request, "openclass/member_list.html", context)
 
 @login_required
 def members_detail(request, username):
-    user = get_object_or_404(User, username=username, is_superuser=False)
-    return render(request, "openclass/profile.html", {"user":user})
-
+    profile = get_object_or_404(
+                    Profile.objects.with_page_data(),
+                    user__username=username,
+                    user__is_superuser=False,
+                    )
+    return render(request, "openclass/profile.html", {"user":profile.user})
+
+@cache_anonymous_page('badges')
 def badges_list(request):
     badges = Badge.objects.all()
     context = {"badges": badges}
@@ -349,7 +450,8 @@ def badges_list(request):
 
 @login_required
 def profile(request):
-    return render(request, "openclass/profile.html")
+    profile = Profile.objects.with_page_data().get(user=request.user)
+    return render(request, "openclass/profile.html", {"user":profile.user})
 
 @login_required
 def prefs(request):
@@ -406,7 +508,9 @@ def signup(request):
 
 def verify(request, token):
     try:
-        verification_token = VerificationToken.objects.get(value=token)
+        verification_token = VerificationToken.objects.select_related(
+                                    'profile__user',
+                                    ).get(value=token)
     except VerificationToken.DoesNotExist:
         return HttpResponse("Bad token")
 
@@ -512,6 +616,46 @@ def user_attendance(request, workshop_pk, user_pk):
               }
     return render(request, "openclass/user-attendance.html", context)
 
+@csrf_exempt
+@require_POST
+def checkin(request, token):
+    """Check in at the door with the signed token of a registration, no
+    account needed. The scanner sends the door key of the workshop in the
+    X-Door-Key header or the door_key field. Scanning the same token
+    twice does no harm."""
+
+    door_key = request.META.get('HTTP_X_DOOR_KEY') or \
+               request.POST.get('door_key', '')
+    try:
+        door_workshop_pk = Workshop.read_door_key(door_key)
+    except signing.BadSignature:
+        return JsonResponse({'status': 'invalid_door_key'}, status=403)
+    try:
+        workshop_pk, profile_pk = Registration.read_checkin_token(token)
+    except signing.BadSignature:
+        return JsonResponse({'status': 'invalid_token'}, status=400)
+    if workshop_pk != door_workshop_pk:
+        return JsonResponse({'status': 'wrong_workshop'}, status=400)
+    workshop = get_object_or_404(Workshop, pk=workshop_pk)
+
+    if workshop.start_date > timezone.now():
+        status = 'workshop_not_started'
+    elif not workshop.is_in_progress():
+        status = 'workshop_over'
+    elif workshop.mark_attendance([profile_pk]):
+        status = 'checked_in'
+    elif Registration.objects.filter(
+                            workshop=workshop,
+                            profile=profile_pk,
+                            status=Registration.ACCEPTED,
+                            present=True,
+                            ).exists():
+        status = 'already_checked_in'
+    else:
+        status = 'not_registered'
+    metrics.inc_counter('openclass_checkins_total', {'status': status})
+    return JsonResponse({'status': status})
+
 @login_required
 def register_to_workshop(request):
     workshop_pk = request.POST['workshop_pk']
@@ -522,7 +666,8 @@ def register_to_workshop(request):
         error = {'status': 'workshop_does_not_exist'}
         return JsonResponse(error)
 
-    if request.user.profile.is_registered(workshop):
+    registration = request.user.profile.registration_state(workshop)
+    if registration.is_registered:
         error = {'status': 'already_registred'}
         return JsonResponse(error)
 
@@ -547,7 +692,8 @@ def cancel_registration(request):
         error = {'status': 'workshop_does_not_exist'}
         return JsonResponse(error)
 
-    if not request.user.profile.is_registered(workshop):
+    registration = request.user.profile.registration_state(workshop)
+    if not registration.is_registered:
         error = {'status': 'not_registred'}
         return JsonResponse(error)
 
@@ -641,6 +787,7 @@ def workshop_questions_list(request, workshop_pk):
         return render(request, "openclass/workshop_questions_list.html", context)
 
 
+@cache_anonymous_page('faq')
 def faq(request):
     faqs = FAQ.objects.all()
     context = {'faqs': faqs}
@@ -694,27 +841,20 @@ def feedback(request, workshop_pk):
     elif request.method == "POST":
         mc_questions_re = "^%s\d+$" % mc_questions_prefix
         comment = request.POST['comment']
-        feedback = Feedback.objects.create(
-                        workshop=workshop,
-                        author=profile,
-                        submission_date=timezone.now(),
-                        comment=comment
-                        )
-        new_choices = []
+        answers = {}
         for mc_question_pk, choice_pk in request.POST.items():
-            if re.match(mc_questions_re, mc_question_pk):
-                mc_question_pk = mc_question_pk.split('_')[-1]
-                try:
-                    mc_question = MCQuestion.objects.get(pk=mc_question_pk)
-                    if workshop not in mc_question.workshop_set.all():
-                        continue
-                    choice = Choice.objects.get(pk=choice_pk)
-                    if choice not in mc_question.choices.all():
-                        continue
-                except:
-                    pass
-                new_choices.append(choice_pk)
-        feedback.choices.add(*new_choices)
+            if re.match(mc_questions_re, mc_question_pk) and \
+                    choice_pk.isdigit():
+                mc_question_pk = int(mc_question_pk.split('_')[-1])
+                answers[mc_question_pk] = int(choice_pk)
+        with transaction.atomic():
+            feedback = Feedback.objects.create(
+                            workshop=workshop,
+                            author=profile,
+                            submission_date=timezone.now(),
+                            comment=comment
+                            )
+            feedback.add_answers(answers)
         title = 'Feedback submitted'
         msg = 'Thank you, your feedback has been submitted'
         context = {'title': title, 'msg': msg}
@@ -726,18 +866,42 @@ def user_questions(request):
     context = {"questions": questions}
     return render(request, "openclass/user-questions.html", context)
 
+LEADERBOARD_PAGE_SIZE = 25
+
 @login_required
 def scoreboard(request):
-    if request.method == 'GET':
-        filters = Q(is_active=True, is_superuser=False)
-        users = Profile.objects.order_by('-score')
-        if users.count() > 1:
-            first = users[0]
-            if users.count() > 2:
-                second = users[1]
-                if users.count() > 3:
-                    third = users[2]
-                    return render(request, "openclass/scoreboard.html", {"users":users,'first':first,'second':second,'third':third})
-                return render(request, "openclass/scoreboard.html", {"users":users,'first':first,'second':second})
-            return render(request, "openclass/scoreboard.html", {"users":users,'first':first})
-        return render(request, "openclass/scoreboard.html", {"users":users})
\ No newline at end of file
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+
+    ranking = leaderboard.top(offset, LEADERBOARD_PAGE_SIZE)
+    profiles = Profile.objects.select_related('user').in_bulk(
+                                            [pk for pk, score in ranking]
+                                            )
+    ranking = [
+        (offset + i + 1, profiles[pk], score)
+        for i, (pk, score) in enumerate(ranking)
+        if pk in profiles # deleted since the last rebuild
+        ]
+    members_number = leaderboard.size()
+    my_rank = None
+    if hasattr(request.user, 'profile'): # superusers have no profile
+        my_rank = leaderboard.rank(request.user.profile)
+    context = {
+                "ranking": ranking,
+                "my_rank": my_rank,
+                "members_number": members_number,
+                "page": page,
+                "has_previous": page > 1,
+                "has_next": offset + LEADERBOARD_PAGE_SIZE < members_number,
+              }
+    return render(request, "openclass/scoreboard.html", context)
+
+
+def metrics_endpoint(request):
+    return HttpResponse(
+                metrics.render(),
+                content_type='text/plain; version=0.0.4; charset=utf-8',
+                )
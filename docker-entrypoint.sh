@@ -17,6 +17,14 @@ echo "Updating Database Tables"
 ./manage.py migrate
 echo "The Database has been updated"
 
+# the denormalized counters start at 0 on the existing workshops
+echo "Recounting the registrations..."
+./manage.py recount_registrations
+
+# the members ranking, kept in redis
+echo "Rebuilding the leaderboard..."
+./manage.py rebuild_leaderboard
+
 # create admin user
 echo "Superuser..."
 cat /create_superuser.py | ./manage.py shell
@@ -24,6 +32,14 @@ cat /create_superuser.py | ./manage.py shell
 # collect static files
 ./manage.py collectstatic --no-input
 
+# send the queued emails in the background, restarted if it ever exits
+echo "Starting the email worker..."
+while true; do
+  ./manage.py send_queued_mail --loop
+  echo "The email worker exited, restarting..."
+  sleep 5
+done &
+
 # run the server
 echo "Starting the server..."
 gunicorn OpenClassProject.wsgi --bind 0.0.0.0:8000 --reload